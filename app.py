@@ -1,8 +1,24 @@
 import streamlit as st
 import pandas as pd
-from supabase import create_client, Client
+import numpy as np
+from supabase import create_client, Client, ClientOptions
+import httpx
 from datetime import datetime
 import pytz
+import threading
+import time
+import random
+import os
+import json
+import uuid
+import sqlite3
+import re
+import unicodedata
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from abc import ABC, abstractmethod
+from streamlit.errors import StreamlitAPIException
 
 # =========================================================
 # CONFIG
@@ -258,23 +274,578 @@ TZ_AR = pytz.timezone("America/Argentina/Buenos_Aires")
 # CONSTANTES
 # =========================================================
 DEFAULT_CATEGORIAS = ["Labios", "Ojos", "Rostro", "Skincare", "Accesorios"]
+CACHE_TTL = 60                    # segundos
+PAGINA_SUPABASE = 1000            # PostgREST corta en 1000 filas por request
+FIN_RECONCILIAR_SEG = 10 * 60     # cada cuánto chequear borrados hechos desde otro lado
+LOTE_IDS = 200                    # ids por request en los filtros `in` (el largo de la URL tiene tope)
+MAX_OPCIONES_SELECTOR = 50
+
+# Transporte con Supabase (cada valor se puede pisar desde secrets.toml)
+SUPABASE_TIMEOUT_CONEXION = 5.0   # seg para abrir la conexión
+SUPABASE_TIMEOUT = 20.0           # seg máximos por request (lectura/escritura)
+SUPABASE_MAX_CONEXIONES = 20      # pool keep-alive compartido por todas las sesiones
+LECTURA_REINTENTOS = 3            # solo lecturas: son idempotentes
+LECTURA_BACKOFF_SEG = 0.5         # 0.5 s, 1 s, 2 s... (con jitter)
+
+# Dónde viven los datos: "supabase" (proyecto hosted) o "sqlite" (un archivo
+# local, para un solo equipo o para correr sin red). Se elige con ALMACEN en secrets.toml
+ALMACEN = "supabase"
+TAMANIOS_PAGINA = [25, 50, 100, 200]
+
+# Navegación: solo se calcula la sección visible
+SECCIONES = ["📦 Inventario", "💰 Nueva Venta", "💸 Nuevo Gasto", "📊 Finanzas", "🏷️ Categorías", "💌 About"]
+SUB_INVENTARIO = ["🔍 Buscar", "➕ Agregar/Reponer", "✏️ Editar", "📉 Ajuste", "🗑️ Eliminar"]
+SUB_CATEGORIAS = ["➕ Agregar", "✏️ Renombrar", "🗑️ Eliminar"]
+
+# Tablas que hacen falta además de inventario y categorías (header + índice)
+TABLAS_POR_SECCION = {"📊 Finanzas": ["finanzas"]}
+
+# Prefijos de keys de widgets de cada sección (para conservar su estado al navegar)
+ESTADO_POR_SECCION = {
+    "📦 Inventario": ("inv_sub", "edit_", "adj_", "del_sel_"),
+    "💰 Nueva Venta": ("cart_",),
+    "📊 Finanzas": ("fin_",),
+    "🏷️ Categorías": ("cat_sub", "cat_ren_old", "cat_del_sel"),
+}
+
+# Columnas que usa cada parte de la app. Cada tabla baja solo la unión de
+# sus consumidores (nada de select("*")): si mañana inventario suma notas,
+# imágenes o códigos que nadie muestra, no pesan en cada rerun.
+COLUMNAS = {
+    "inventario": {
+        "badge_stock": ["stock"],
+        "catalogo": ["id", "producto", "marca", "categoria", "categoria_id"],
+        "precios": ["precio_costo", "precio_venta"],
+        "caja": ["codigo"],
+        "concurrencia": ["version"],
+    },
+    "finanzas": {
+        "detalle": ["id", "fecha", "tipo", "descripcion", "monto"],
+    },
+    "categorias": {
+        "selector": ["id", "nombre"],
+    },
+}
 # =========================================================
-# CONEXIÓN SUPABASE (cacheada)
+# LECTURAS: reintentos + coalescing
 # =========================================================
-try:
-    url = st.secrets["SUPABASE_URL"]
-    key = st.secrets["SUPABASE_KEY"]
+def es_transitorio(e: Exception) -> bool:
+    """Timeouts / conexión caída / gateway o PostgREST sin base: vale la pena reintentar."""
+    if isinstance(e, httpx.TransportError):
+        return True
+    if isinstance(e, sqlite3.OperationalError) and "locked" in str(e):
+        return True  # otro proceso escribiendo el archivo local
+    return str(getattr(e, "code", "")) in {"502", "503", "504", "520", "PGRST000", "PGRST001", "PGRST002"}
+
+
+class LecturasEnVuelo:
+    """
+    Coalescing de lecturas: si otra sesión ya está haciendo exactamente el
+    mismo request, se espera su respuesta en vez de repetirlo.
+    La respuesta se comparte: tratarla como de solo lectura.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._vuelos = {}
+
+    def ejecutar(self, clave, fn):
+        if clave is None:
+            return fn()
+        with self._lock:
+            vuelo = self._vuelos.get(clave)
+            lider = vuelo is None
+            if lider:
+                vuelo = self._vuelos[clave] = {"listo": threading.Event()}
+        if not lider:
+            vuelo["listo"].wait()
+            if "error" in vuelo:
+                raise vuelo["error"]
+            return vuelo["res"]
+        try:
+            vuelo["res"] = fn()
+            return vuelo["res"]
+        except Exception as e:
+            vuelo["error"] = e
+            raise
+        finally:
+            with self._lock:
+                self._vuelos.pop(clave, None)
+            vuelo["listo"].set()
+
+
+@st.cache_resource
+def lecturas_en_vuelo() -> LecturasEnVuelo:
+    return LecturasEnVuelo()
+
+
+def _clave_lectura(q):
+    r = getattr(q, "request", None)
+    if r is None:
+        return None
+    return (str(r.http_method), str(r.path), str(r.params), r.headers.get("prefer"), repr(r.json))
+
+
+def leer(q):
+    """
+    execute() de una lectura: reintentos con backoff exponencial ante fallas
+    transitorias y coalescing con otras sesiones que piden lo mismo.
+    Las escrituras NO pasan por acá (reintentarlas podría duplicarlas).
+    """
+    def _con_reintentos():
+        for intento in range(LECTURA_REINTENTOS + 1):
+            try:
+                return q.execute()
+            except Exception as e:
+                if intento == LECTURA_REINTENTOS or not es_transitorio(e):
+                    raise
+                time.sleep(LECTURA_BACKOFF_SEG * 2 ** intento * (0.5 + random.random()))
+
+    return lecturas_en_vuelo().ejecutar(_clave_lectura(q), _con_reintentos)
+
+
+# =========================================================
+# ALMACENAMIENTO (Supabase o SQLite embebido)
+# =========================================================
+class Repositorio(ABC):
+    """
+    Todo el acceso a datos de la app pasa por acá: inventario, finanzas,
+    categorías y las RPCs (venta de carrito, borrado con restitución, ajuste,
+    reposición, escritura idempotente).
+    Las filas van y vienen como list[dict] (lo mismo que devuelve PostgREST)
+    y los filtros son igualdades columna=valor.
+    Un backend al que le falte un método no se puede instanciar.
+    """
 
-    @st.cache_resource
-    def init_connection():
-        return create_client(url, key)
+    nombre = ""
+    pista_falla = ""   # qué revisar si no se pudo leer (para el mensaje de error)
+    pista_espera = ""  # por qué una escritura del diario sigue pendiente
+
+    @abstractmethod
+    def bajar(self, tabla: str, columnas: str = "*", desde_id: int = 0) -> list:
+        """Todas las filas con id > desde_id, ordenadas por id."""
+        ...
+
+    @abstractmethod
+    def bajar_ids(self, tabla: str, columnas: str, ids) -> list:
+        """Las filas con esos ids (las que existan), ordenadas por id."""
+        ...
+
+    @abstractmethod
+    def buscar_finanzas(self, busq: str, columnas: str, limite: int) -> list:
+        """Los `limite` movimientos más nuevos que matchean "término / término / ..."."""
+        ...
+
+    @abstractmethod
+    def contar(self, tabla: str, **filtros) -> int:
+        ...
+
+    @abstractmethod
+    def insertar(self, tabla: str, fila: dict) -> list:
+        """Devuelve la fila insertada completa (con id)."""
+        ...
+
+    @abstractmethod
+    def actualizar(self, tabla: str, cambios: dict, **filtros) -> list:
+        """Devuelve las filas que matchearon, ya actualizadas ([] si ninguna)."""
+        ...
+
+    @abstractmethod
+    def borrar(self, tabla: str, **filtros):
+        ...
+
+    @abstractmethod
+    def rpc(self, nombre: str, args: dict = None):
+        ...
+
+
+class RepoSupabase(Repositorio):
+    """El proyecto Supabase vía PostgREST (las lecturas pasan por leer())."""
+
+    nombre = "Supabase"
+    pista_falla = "¿conexión lenta o caída?"
+    pista_espera = "esperando conexión con Supabase"
+
+    def __init__(self, cliente: Client):
+        self.cliente = cliente
+
+    @staticmethod
+    def _filtrar(q, filtros: dict):
+        for col, valor in filtros.items():
+            q = q.eq(col, valor)
+        return q
+
+    def bajar(self, tabla: str, columnas: str = "*", desde_id: int = 0) -> list:
+        # PostgREST corta en 1000 filas: paginamos por id
+        filas = []
+        while True:
+            q = self.cliente.table(tabla).select(columnas).gt("id", desde_id)
+            res = leer(q.order("id").limit(PAGINA_SUPABASE))
+            lote = res.data or []
+            filas.extend(lote)
+            if len(lote) < PAGINA_SUPABASE:
+                return filas
+            desde_id = int(lote[-1]["id"])
+
+    def bajar_ids(self, tabla: str, columnas: str, ids) -> list:
+        ids = sorted(int(i) for i in ids)
+        filas = []
+        for i in range(0, len(ids), LOTE_IDS):
+            q = self.cliente.table(tabla).select(columnas).in_("id", ids[i:i + LOTE_IDS])
+            filas.extend(leer(q.order("id")).data or [])
+        return filas
+
+    def buscar_finanzas(self, busq: str, columnas: str, limite: int) -> list:
+        q = self.cliente.table("finanzas").select(columnas)
+        for filtro in filtros_busqueda(busq):
+            q = q.or_(filtro)
+        return leer(q.order("id", desc=True).limit(limite)).data or []
+
+    def contar(self, tabla: str, **filtros) -> int:
+        # solo el conteo, sin bajar filas
+        q = self.cliente.table(tabla).select("id", count="exact", head=True)
+        return int(leer(self._filtrar(q, filtros)).count or 0)
+
+    def insertar(self, tabla: str, fila: dict) -> list:
+        return self.cliente.table(tabla).insert(fila).execute().data or []
+
+    def actualizar(self, tabla: str, cambios: dict, **filtros) -> list:
+        return self._filtrar(self.cliente.table(tabla).update(cambios), filtros).execute().data or []
+
+    def borrar(self, tabla: str, **filtros):
+        self._filtrar(self.cliente.table(tabla).delete(), filtros).execute()
+
+    def rpc(self, nombre: str, args: dict = None):
+        return self.cliente.rpc(nombre, args or {}).execute().data
+
+
+class RepoSQLite(Repositorio):
+    """
+    Todo en un archivo SQLite local (WAL, una conexión por thread): un solo
+    equipo, sin red. Mismo esquema que el proyecto Supabase y las mismas RPCs
+    (sql/002-006), incluida la venta de carrito y su restitución al borrarla.
+    Cada RPC corre en una transacción `begin immediate`: las escrituras
+    concurrentes se serializan como con los locks de fila del server.
+    """
 
-    supabase: Client = init_connection()
+    nombre = "SQLite"
+    pista_falla = "¿el archivo de datos está bloqueado por otro proceso?"
+    pista_espera = "esperando que se libere el archivo de datos local"
+
+    ESQUEMA = """
+        create table if not exists categorias (
+            id integer primary key autoincrement,
+            nombre text not null
+        );
+        create table if not exists inventario (
+            id integer primary key autoincrement,
+            producto text not null,
+            marca text,
+            categoria text,
+            categoria_id integer,
+            stock integer not null default 0 check (stock >= 0),
+            precio_costo real,
+            precio_venta real,
+            codigo text,
+            version integer not null default 1
+        );
+        create unique index if not exists inventario_codigo_uidx
+            on inventario (upper(trim(codigo)))
+            where codigo is not null and trim(codigo) <> '';
+        create table if not exists finanzas (
+            id integer primary key autoincrement,
+            fecha text,
+            tipo text,
+            descripcion text,
+            monto real not null default 0,
+            producto_id integer,
+            cantidad integer,
+            metodo_pago text
+        );
+        -- detalle de cada venta de carrito: lo que se restituye si se borra
+        create table if not exists venta_items (
+            finanzas_id integer not null references finanzas (id) on delete cascade,
+            producto_id integer not null,
+            cantidad integer not null
+        );
+        create index if not exists venta_items_finanzas_idx on venta_items (finanzas_id);
+        create table if not exists operaciones_aplicadas (
+            clave text primary key,
+            op text not null,
+            resultado text,
+            aplicada_en text not null default current_timestamp
+        );
+    """
 
-except Exception:
-    st.error("❌ Error de conexión: Revisá tus secretos (.streamlit/secrets.toml).")
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        self._local = threading.local()
+        con = self._con()
+        con.executescript(self.ESQUEMA)
+        with self._tx() as con:
+            if not con.execute("select 1 from categorias limit 1").fetchone():
+                con.executemany("insert into categorias (nombre) values (?)", [(c,) for c in DEFAULT_CATEGORIAS])
+
+    def _con(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        if con is None:
+            # autocommit: las transacciones se abren a mano en _tx()
+            con = sqlite3.connect(self.ruta, timeout=10, isolation_level=None)
+            con.row_factory = sqlite3.Row
+            con.execute("pragma journal_mode=wal")
+            con.execute("pragma synchronous=normal")
+            con.execute("pragma foreign_keys=on")
+            self._local.con = con
+        return con
+
+    @contextmanager
+    def _tx(self):
+        con = self._con()
+        con.execute("begin immediate")
+        try:
+            yield con
+        except BaseException:
+            con.execute("rollback")
+            raise
+        con.execute("commit")
+
+    def _filas(self, sql: str, params=()) -> list:
+        return [dict(r) for r in self._con().execute(sql, params)]
+
+    @staticmethod
+    def _donde(filtros: dict) -> tuple:
+        if not filtros:
+            return "", []
+        return " where " + " and ".join(f"{c} = ?" for c in filtros), list(filtros.values())
+
+    # ----- lecturas -----
+    def bajar(self, tabla: str, columnas: str = "*", desde_id: int = 0) -> list:
+        return self._filas(f"select {columnas} from {tabla} where id > ? order by id", (desde_id,))
+
+    def bajar_ids(self, tabla: str, columnas: str, ids) -> list:
+        ids = sorted(int(i) for i in ids)
+        filas = []
+        for i in range(0, len(ids), LOTE_IDS):  # tope de variables por sentencia
+            lote = ids[i:i + LOTE_IDS]
+            marcas = ", ".join("?" * len(lote))
+            filas.extend(self._filas(f"select {columnas} from {tabla} where id in ({marcas}) order by id", lote))
+        return filas
+
+    def buscar_finanzas(self, busq: str, columnas: str, limite: int) -> list:
+        # mismos términos que filtros_busqueda(): un OR por término, AND entre términos
+        condiciones, params = [], []
+        for texto, monto in terminos_busqueda(busq):
+            patron = "%" + re.sub(r"([_])", r"\\\1", texto) + "%"
+            if monto is not None:
+                condiciones.append("(monto = ? or monto = ? or descripcion like ? escape '\\')")
+                params += [monto, -monto, patron]
+            else:
+                condiciones.append(
+                    "(descripcion like ? escape '\\' or tipo like ? escape '\\' or metodo_pago like ? escape '\\')"
+                )
+                params += [patron] * 3
+        donde = " where " + " and ".join(condiciones) if condiciones else ""
+        return self._filas(f"select {columnas} from finanzas{donde} order by id desc limit ?", (*params, limite))
+
+    def contar(self, tabla: str, **filtros) -> int:
+        donde, params = self._donde(filtros)
+        return self._con().execute(f"select count(*) from {tabla}{donde}", params).fetchone()[0]
+
+    # ----- escrituras -----
+    def _insertar(self, con, tabla: str, fila: dict) -> dict:
+        marcas = ", ".join("?" * len(fila))
+        sql = f"insert into {tabla} ({', '.join(fila)}) values ({marcas}) returning *"
+        return dict(con.execute(sql, list(fila.values())).fetchone())
+
+    def _actualizar(self, con, tabla: str, cambios: dict, **filtros) -> list:
+        sets = [f"{c} = ?" for c in cambios]
+        if tabla == "inventario":
+            sets.append("version = version + 1")  # lo que hace el trigger de sql/005
+        donde, params = self._donde(filtros)
+        sql = f"update {tabla} set {', '.join(sets)}{donde} returning *"
+        return [dict(r) for r in con.execute(sql, [*cambios.values(), *params])]
+
+    def insertar(self, tabla: str, fila: dict) -> list:
+        with self._tx() as con:
+            return [self._insertar(con, tabla, fila)]
+
+    def actualizar(self, tabla: str, cambios: dict, **filtros) -> list:
+        with self._tx() as con:
+            return self._actualizar(con, tabla, cambios, **filtros)
+
+    def borrar(self, tabla: str, **filtros):
+        donde, params = self._donde(filtros)
+        with self._tx() as con:
+            con.execute(f"delete from {tabla}{donde}", params)
+
+    # ----- RPCs (mismas firmas que las funciones de Supabase) -----
+    def rpc(self, nombre: str, args: dict = None):
+        fn = getattr(self, f"_rpc_{nombre}", None)
+        if fn is None:
+            raise ValueError(f"Could not find the function {nombre}")
+        with self._tx() as con:
+            return fn(con, **(args or {}))
+
+    def _mover_stock(self, con, producto_id: int, delta: int) -> dict:
+        fila = con.execute(
+            "update inventario set stock = stock + ?, version = version + 1"
+            " where id = ? and stock + ? >= 0 returning *",
+            (delta, producto_id, delta),
+        ).fetchone()
+        if fila is None:
+            if con.execute("select 1 from inventario where id = ?", (producto_id,)).fetchone():
+                raise ValueError("stock insuficiente")
+            raise ValueError("producto inexistente")
+        return dict(fila)
+
+    def _rpc_registrar_venta_carrito(self, con, p_items, p_monto_total, p_descripcion, p_metodo_pago, p_fecha=None):
+        for it in p_items:
+            self._mover_stock(con, int(it["producto_id"]), -int(it["cantidad"]))
+        fila = {
+            "fecha": p_fecha or now_ar_str(),
+            "tipo": "Venta",
+            "descripcion": p_descripcion,
+            "monto": float(p_monto_total),
+            "metodo_pago": p_metodo_pago,
+        }
+        if len(p_items) == 1:
+            fila["producto_id"] = int(p_items[0]["producto_id"])
+            fila["cantidad"] = int(p_items[0]["cantidad"])
+        fin = self._insertar(con, "finanzas", fila)
+        con.executemany(
+            "insert into venta_items (finanzas_id, producto_id, cantidad) values (?, ?, ?)",
+            [(fin["id"], int(it["producto_id"]), int(it["cantidad"])) for it in p_items],
+        )
+        return None
+
+    def _rpc_borrar_movimiento_y_restituir(self, con, p_finanzas_id):
+        fin = con.execute("select tipo, producto_id, cantidad from finanzas where id = ?", (p_finanzas_id,)).fetchone()
+        if fin is None:
+            return None
+        if fin["tipo"] == "Venta":
+            items = con.execute(
+                "select producto_id, cantidad from venta_items where finanzas_id = ?", (p_finanzas_id,)
+            ).fetchall()
+            if not items and fin["producto_id"] and fin["cantidad"]:
+                items = [(fin["producto_id"], fin["cantidad"])]  # venta suelta sin detalle
+            for producto_id, cantidad in items:
+                # si el producto ya no existe no hay nada que restituir
+                con.execute(
+                    "update inventario set stock = stock + ?, version = version + 1 where id = ?",
+                    (int(cantidad), int(producto_id)),
+                )
+        con.execute("delete from finanzas where id = ?", (p_finanzas_id,))
+        return None
+
+    def _rpc_ajustar_stock(self, con, p_producto_id, p_delta, p_motivo, p_fecha=None):
+        if int(p_delta) == 0:
+            raise ValueError("delta inválido")
+        inv = self._mover_stock(con, int(p_producto_id), int(p_delta))
+        signo = "-" if int(p_delta) < 0 else "+"
+        fin = self._insertar(con, "finanzas", {
+            "fecha": p_fecha or now_ar_str(),
+            "tipo": "Ajuste",
+            "descripcion": f"Ajuste: {signo}{abs(int(p_delta))}x {inv['producto']} ({inv['marca']}) | Motivo: {p_motivo}",
+            "monto": 0,
+        })
+        return {"inventario": inv, "finanzas": fin}
+
+    def _rpc_reponer_stock(self, con, p_producto_id, p_cantidad, p_precio_costo, p_precio_venta,
+                           p_categoria, p_categoria_id, p_codigo=None):
+        if int(p_cantidad) <= 0:
+            raise ValueError("cantidad inválida")
+        fila = con.execute(
+            "update inventario set stock = stock + ?, precio_costo = ?, precio_venta = ?,"
+            " categoria = ?, categoria_id = ?, codigo = coalesce(nullif(trim(?), ''), codigo),"
+            " version = version + 1 where id = ? returning *",
+            (int(p_cantidad), p_precio_costo, p_precio_venta, p_categoria, p_categoria_id,
+             p_codigo or "", int(p_producto_id)),
+        ).fetchone()
+        if fila is None:
+            raise ValueError("producto inexistente")
+        inv = dict(fila)
+        fin = self._insertar(con, "finanzas", {
+            "fecha": now_ar_str(),
+            "tipo": "Reposición",
+            "descripcion": f"Reposición: +{int(p_cantidad)}x {inv['producto']} ({inv['marca']})",
+            "monto": 0,
+        })
+        return {"inventario": inv, "finanzas": fin}
+
+    def _rpc_ejecutar_idempotente(self, con, p_clave, p_op, p_args):
+        previo = con.execute("select resultado from operaciones_aplicadas where clave = ?", (p_clave,)).fetchone()
+        if previo is not None:
+            return json.loads(previo["resultado"])
+        if p_op == "venta":
+            res = self._rpc_registrar_venta_carrito(con, **p_args)
+        elif p_op == "finanzas":
+            res = self._insertar(con, "finanzas", p_args)
+        elif p_op == "ajuste":
+            res = self._rpc_ajustar_stock(con, **p_args)
+        else:
+            raise ValueError(f"operación desconocida: {p_op}")
+        # misma transacción: si la operación falla, la clave no queda registrada
+        con.execute(
+            "insert into operaciones_aplicadas (clave, op, resultado) values (?, ?, ?)",
+            (p_clave, p_op, json.dumps(res)),
+        )
+        return res
+
+
+# =========================================================
+# CONEXIÓN (Supabase o SQLite, cacheada)
+# =========================================================
+def secreto(nombre: str, defecto):
+    """Valor de secrets.toml (con el tipo del default); sin secrets.toml, el default."""
+    try:
+        return type(defecto)(st.secrets.get(nombre, defecto))
+    except FileNotFoundError:
+        return defecto
+
+
+def ruta_local(archivo: str) -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), archivo)
+
+
+usa_sqlite = secreto("ALMACEN", ALMACEN) == "sqlite"
+try:
+    if usa_sqlite:
+        @st.cache_resource
+        def init_connection() -> Repositorio:
+            return RepoSQLite(secreto("SQLITE_PATH", ruta_local("ilara.sqlite3")))
+    else:
+        url = st.secrets["SUPABASE_URL"]
+        key = st.secrets["SUPABASE_KEY"]
+
+        @st.cache_resource
+        def init_connection() -> Repositorio:
+            # un solo cliente HTTP por proceso: reusa conexiones (keep-alive) entre
+            # reruns y sesiones, y ningún request puede colgar la página para siempre
+            http = httpx.Client(
+                timeout=httpx.Timeout(
+                    secreto("SUPABASE_TIMEOUT", SUPABASE_TIMEOUT),
+                    connect=secreto("SUPABASE_TIMEOUT_CONEXION", SUPABASE_TIMEOUT_CONEXION),
+                ),
+                limits=httpx.Limits(
+                    max_connections=secreto("SUPABASE_MAX_CONEXIONES", SUPABASE_MAX_CONEXIONES),
+                    max_keepalive_connections=secreto("SUPABASE_MAX_CONEXIONES", SUPABASE_MAX_CONEXIONES),
+                    keepalive_expiry=60,
+                ),
+                http2=True,
+                follow_redirects=True,
+            )
+            return RepoSupabase(create_client(url, key, options=ClientOptions(httpx_client=http)))
+
+    almacen: Repositorio = init_connection()
+
+except Exception as e:
+    if usa_sqlite:
+        st.error(f"❌ No se pudo abrir la base local: revisá SQLITE_PATH en .streamlit/secrets.toml.\n\n{e}")
+    else:
+        st.error("❌ Error de conexión: Revisá tus secretos (.streamlit/secrets.toml).")
     st.stop()
 
+
 # =========================================================
 # HELPERS
 # =========================================================
@@ -282,6 +853,14 @@ def queue_toast(msg: str, icon: str = "✅"):
     """Queue a toast to be shown after st.rerun()."""
     st.session_state["_toast"] = {"msg": msg, "icon": icon}
 
+
+def rerun_fragmento():
+    """st.rerun() acotado al fragmento; si el fragmento corrió dentro de la app entera, rerun normal."""
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
 # Show queued toast (survives rerun)
 if "_toast" in st.session_state:
     t = st.session_state.pop("_toast")
@@ -290,12 +869,12 @@ if "_toast" in st.session_state:
     except Exception:
         pass
 
-def limpiar_cache():
-    st.cache_data.clear()
+FORMATO_FECHA_AR = "%d/%m/%Y %H:%M"
+RX_FECHA_AR = r"^\d{2}/\d{2}/\d{4} \d{2}:\d{2}$"
 
 def now_ar_str():
     # Fecha “linda” AR (si tu columna fecha es string)
-    return datetime.now(TZ_AR).strftime("%d/%m/%Y %H:%M")
+    return datetime.now(TZ_AR).strftime(FORMATO_FECHA_AR)
 
 def formatear_monto_ars(x):
     try:
@@ -303,69 +882,1162 @@ def formatear_monto_ars(x):
     except:
         return str(x)
 
-def formatear_fecha_arg(df: pd.DataFrame) -> pd.DataFrame:
+# =========================================================
+# PRESENTACIÓN (formato vectorizado, por columna)
+# =========================================================
+# tablas de trozos ya formateados: armar un monto es indexar y concatenar
+_MILES = np.array([f".{i:03d}" for i in range(1000)], dtype=object)     # grupo con punto y ceros
+_GRUPO_ALTO = np.array([f"{i}" for i in range(1000)], dtype=object)     # el grupo de más a la izquierda
+_CENTAVOS = np.array([f",{i:02d}" for i in range(100)], dtype=object)
+
+
+def formatear_montos_ars(valores: pd.Series) -> pd.Series:
+    """
+    Versión por columna de formatear_monto_ars (mismo resultado): $1.234,50 / $-200,00.
+    Los grupos de miles salen de tablas precalculadas (nada de format()
+    y replace fila por fila).
+    """
+    valores = pd.Series(valores)
+    num = pd.to_numeric(valores, errors="coerce")
+    arr = num.to_numpy(dtype=float, na_value=np.nan)
+    # NaN / None / texto / inf: los resuelve la versión escalar, igual que antes
+    raro = ~np.isfinite(arr)
+    x100 = np.abs(np.where(raro, 0.0, arr)) * 100
+    # casi-empates (x,xx5): format() redondea el valor binario exacto y x * 100
+    # puede caer del otro lado; esos (pocos) también van por la escalar
+    frac = x100 - np.floor(x100)
+    empate = ~raro & (np.abs(frac - 0.5) <= np.maximum(1e-6, x100 * 1e-15))
+    enteros, cent = np.divmod(np.rint(x100).astype(np.int64), 100)
+
+    txt = np.where(enteros >= 1000, _MILES[enteros % 1000], _GRUPO_ALTO[enteros % 1000])
+    k = 1
+    while (enteros >= 1000 ** k).any():
+        grupo = (enteros // 1000 ** k) % 1000
+        pieza = np.where(enteros >= 1000 ** (k + 1), _MILES[grupo], _GRUPO_ALTO[grupo])
+        txt = np.where(enteros >= 1000 ** k, pieza + txt, txt)
+        k += 1
+
+    # signbit: -0.0 sale "$-0,00" como en format()
+    prefijo = np.where(np.signbit(arr), "$-", "$").astype(object)
+    out = pd.Series(prefijo + txt + _CENTAVOS[cent], index=valores.index, dtype=object)
+    lento = raro | empate
+    if lento.any():
+        out[lento] = valores[lento].map(formatear_monto_ars)
+    return out
+
+
+def estado_stock(stock: pd.Series) -> pd.Series:
+    """Chip de estado por columna: 🛑 Agotado (<=0) / ⚠️ Bajo (<=3) / ✅ OK."""
+    s = pd.to_numeric(stock, errors="coerce").fillna(0)
+    return pd.Series(np.select([s <= 0, s <= 3], ["🛑 Agotado", "⚠️ Bajo"], "✅ OK"), index=stock.index)
+
+
+def etiquetas_movimientos(df: pd.DataFrame) -> pd.Series:
+    """'fecha | tipo | descripción | monto | (ID:n)' para todo el ledger de una."""
+    return (
+        df["fecha_fmt"].astype(str) + " | " + df["tipo"].astype(str) + " | "
+        + df["descripcion"].astype(str) + " | " + df["monto_fmt"].astype(str)
+        + " | (ID:" + df["id"].astype(str) + ")"
+    )
+
+
+def parsear_fechas(fecha: pd.Series) -> pd.Series:
+    """
+    Parsea `fecha` por formato conocido, sin inferencia genérica:
+    - 'dd/mm/aaaa hh:mm' (lo que escribe now_ar_str, hora AR; nunca mes primero)
+    - ISO 8601 (lo que guarda Supabase; sin zona se asume UTC)
+    Devuelve datetimes en hora AR (NaT si no matchea ninguno).
+    """
+    txt = fecha.astype("string").str.strip()
+    es_ar = txt.str.match(RX_FECHA_AR).fillna(False).astype(bool)
+    es_iso = ~es_ar & txt.notna()
+
+    partes = []
+    if es_ar.any():
+        partes.append(
+            pd.to_datetime(txt[es_ar], format=FORMATO_FECHA_AR, errors="coerce")
+            .dt.tz_localize(TZ_AR, ambiguous="NaT", nonexistent="NaT")
+        )
+    if es_iso.any():
+        partes.append(pd.to_datetime(txt[es_iso], format="ISO8601", errors="coerce", utc=True).dt.tz_convert(TZ_AR))
+
+    if not partes:
+        return pd.Series(pd.NaT, index=fecha.index, dtype="datetime64[ns]").dt.tz_localize(TZ_AR)
+    return pd.concat(partes).reindex(fecha.index)
+
+
+class CacheFechas:
     """
-    Convierte timestamps (UTC o ISO) a hora Argentina y formatea.
-    Si ya viniera como string, intenta parsear.
+    fecha_dt ya parseada por id de movimiento: cada fila del ledger se parsea
+    una sola vez y los reruns siguientes solo la buscan. Si el texto de `fecha`
+    de un id cambia, se vuelve a parsear.
+    Con `completo=True` (el ledger entero) se descartan los ids que ya no
+    están, así el cache no crece con los movimientos borrados.
+    """
+
+    NULA = "\x00"  # cómo se guarda una fecha nula (NA != NA la re-parsearía siempre)
+
+    def __init__(self):
+        self.dt = pd.Series(dtype="datetime64[ns]").dt.tz_localize(TZ_AR)
+        self.texto = pd.Series(dtype="string")
+        self._lock = threading.Lock()
+
+    def resolver(self, ids: pd.Series, fecha: pd.Series, completo: bool = False) -> pd.Series:
+        ids = pd.to_numeric(ids, errors="coerce")
+        validos = ids.notna()
+        txt = fecha.astype("string").fillna(self.NULA)
+        out = pd.Series(pd.NaT, index=fecha.index, dtype="datetime64[ns]").dt.tz_localize(TZ_AR)
+
+        with self._lock:
+            claves = ids[validos].astype("int64")
+            previo = self.texto.reindex(claves.values)
+            previo.index = claves.index
+            faltan = claves.index[(previo != txt[validos]).fillna(True).astype(bool)]
+            if len(faltan):
+                nuevos = parsear_fechas(fecha.loc[faltan])
+                nuevos.index = claves.loc[faltan].values
+                nuevos_txt = txt.loc[faltan]
+                nuevos_txt.index = nuevos.index
+                viejos = ~self.dt.index.isin(nuevos.index)
+                self.dt = pd.concat([self.dt[viejos], nuevos[~nuevos.index.duplicated()]])
+                self.texto = pd.concat([self.texto[viejos], nuevos_txt[~nuevos_txt.index.duplicated()]])
+            if completo:
+                vivos = self.dt.index.isin(claves.values)
+                if not vivos.all():
+                    self.dt = self.dt[vivos]
+                    self.texto = self.texto[vivos]
+            encontrados = self.dt.reindex(claves.values)
+            encontrados.index = claves.index
+
+        out.loc[validos] = encontrados
+        if (~validos).any():
+            out.loc[~validos] = parsear_fechas(fecha[~validos])
+        return out
+
+
+@st.cache_resource
+def cache_fechas() -> CacheFechas:
+    return CacheFechas()
+
+
+def formatear_fecha_arg(df: pd.DataFrame, completo: bool = False) -> pd.DataFrame:
+    """
+    Convierte `fecha` (texto AR o ISO) a hora Argentina y formatea.
+    Usa el cache por id, así las filas ya vistas no se vuelven a parsear
+    (`completo`: df es el ledger entero y el cache se poda a sus ids).
     Devuelve columnas: fecha_dt y fecha_fmt.
     """
     if df.empty or "fecha" not in df.columns:
         return df
 
     out = df.copy()
+    if "id" in out.columns:
+        out["fecha_dt"] = cache_fechas().resolver(out["id"], out["fecha"], completo)
+    else:
+        out["fecha_dt"] = parsear_fechas(out["fecha"])
 
-    out["fecha_dt"] = pd.to_datetime(out["fecha"], errors="coerce", utc=True)
-
-    mask_na = out["fecha_dt"].isna()
-    if mask_na.any():
-        out.loc[mask_na, "fecha_dt"] = pd.to_datetime(out.loc[mask_na, "fecha"], errors="coerce")
-
-    try:
-        out["fecha_dt"] = out["fecha_dt"].dt.tz_convert(TZ_AR)
-    except Exception:
-        pass
-
-    out["fecha_fmt"] = out["fecha_dt"].dt.strftime("%d/%m/%Y %H:%M")
+    out["fecha_fmt"] = out["fecha_dt"].dt.strftime(FORMATO_FECHA_AR)
     out["fecha_fmt"] = out["fecha_fmt"].fillna(out["fecha"].astype(str))
     return out
 
 # =========================================================
-# CARGA DE DATOS (cache)
+# CARGA DE DATOS (cache por tabla)
 # =========================================================
-@st.cache_data(ttl=60)
+def columnas(tabla: str) -> str:
+    """Columnas a pedir: la unión de las de todos sus consumidores."""
+    cols = []
+    for grupo in COLUMNAS[tabla].values():
+        for c in grupo:
+            if c not in cols:
+                cols.append(c)
+    return ",".join(cols)
+
+
+def falta_columna(e: Exception) -> bool:
+    """¿El error es por una columna que el server todavía no tiene? (undefined_column)"""
+    return getattr(e, "code", None) == "42703" or "does not exist" in str(e)
+
+
+def falta_funcion(e: Exception) -> bool:
+    """¿El error es por una RPC que el server todavía no tiene? (migración sin correr)"""
+    return getattr(e, "code", None) == "PGRST202" or "Could not find the function" in str(e)
+
+
+def upsert_por_id(df: pd.DataFrame, filas) -> pd.DataFrame:
+    """Reemplaza/agrega filas por id (las que vienen ganan)."""
+    nuevo = filas if isinstance(filas, pd.DataFrame) else pd.DataFrame(filas)
+    if nuevo.empty:
+        return df
+    if df.empty:
+        return nuevo.reset_index(drop=True)
+    ids = pd.to_numeric(nuevo["id"], errors="coerce")
+    base = df[~pd.to_numeric(df["id"], errors="coerce").isin(ids)]
+    return pd.concat([base, nuevo], ignore_index=True)
+
+
+class TablaCache:
+    """
+    Snapshot compartido (entre sesiones) de una tabla del almacén.
+    La invalidación es por tabla y versionada: `invalidar()` sube la
+    generación pedida de esta tabla y solo ella se vuelve a bajar en el
+    próximo `obtener()`; las demás siguen sirviendo desde cache.
+    Las escrituras propias se aplican directo al snapshot (`aplicar`/`quitar`)
+    y después se reconcilia con el server en segundo plano.
+    Si solo venció el TTL se sirve el último snapshot bueno y se refresca en
+    un thread (stale-while-revalidate); solo se bloquea en la carga inicial o
+    cuando la tabla fue invalidada a propósito.
+    `version` sube cada vez que cambian los datos locales.
+    """
+
+    def __init__(self, tabla: str, orden: str = "id"):
+        self.tabla = tabla
+        self.orden = orden
+        self.df = pd.DataFrame()
+        self.version = 0
+        self.sincronizado_en = 0.0
+        self._gen_pedida = 1
+        self._gen_cargada = 0
+        self._lock = threading.Lock()       # protege df/version
+        self._lock_red = threading.Lock()   # una sola bajada a la vez
+        self._diario = None                 # escrituras hechas mientras se baja
+        self._revalidando = False
+        self._otra_vuelta = False
+        self.ultima_bajada_ms = None
+
+    # ----- red -----
+    def _bajar(self):
+        try:
+            return pd.DataFrame(almacen.bajar(self.tabla, columnas(self.tabla)))
+        except Exception as e:
+            if not falta_columna(e):
+                raise
+            # migración sin correr todavía: bajamos lo que haya
+            return pd.DataFrame(almacen.bajar(self.tabla))
+
+    def _integrar(self, df: pd.DataFrame) -> bool:
+        """Reemplaza el snapshot; devuelve si los datos cambiaron."""
+        df = self._ordenar(df)
+        cambio = not df.equals(self.df)
+        self.df = df
+        return cambio
+
+    def _ordenar(self, df: pd.DataFrame) -> pd.DataFrame:
+        if self.orden and not df.empty and self.orden in df.columns:
+            df = df.sort_values(self.orden, kind="stable")
+        return df.reset_index(drop=True)
+
+    def vencida(self) -> bool:
+        return (
+            self._gen_cargada != self._gen_pedida
+            or time.time() - self.sincronizado_en >= CACHE_TTL
+        )
+
+    def sincronizar(self, forzar: bool = False):
+        if not forzar and not self.vencida():
+            return
+        with self._lock_red:
+            if not forzar and not self.vencida():
+                return
+            # si alguien invalida mientras bajamos, la generación nueva queda pendiente
+            gen = self._gen_pedida
+            with self._lock:
+                self._diario = []
+            try:
+                t0 = time.perf_counter()
+                datos = self._bajar()
+                self.ultima_bajada_ms = (time.perf_counter() - t0) * 1000
+                with self._lock:
+                    cambio = self._integrar(datos)
+                    # lo escrito durante la bajada puede no estar en `datos`
+                    for op, arg in self._diario:
+                        self._aplicar_op(op, arg)
+                    # sin cambios no se toca la versión: todo lo derivado sigue valiendo
+                    if cambio or self._diario or not self.sincronizado_en:
+                        self.version += 1
+                    self._gen_cargada = gen
+                    self.sincronizado_en = time.time()
+            finally:
+                with self._lock:
+                    self._diario = None
+
+    def snapshot(self) -> tuple:
+        """(df, version) consistentes entre sí, sin copiar (solo lectura)."""
+        with self._lock:
+            return self.df, self.version
+
+    def edad(self) -> float:
+        return time.time() - self.sincronizado_en if self.sincronizado_en else 0.0
+
+    def asegurar(self):
+        """Deja el snapshot listo para leer (sin copiarlo)."""
+        if self.sincronizado_en and self._gen_cargada == self._gen_pedida:
+            # stale-while-revalidate: lo viejo ya, lo nuevo en el próximo rerun
+            if self.vencida():
+                self.revalidar_en_segundo_plano(tras_escritura=False)
+            return
+        try:
+            self.sincronizar()
+        except Exception:
+            if not self.sincronizado_en:
+                raise  # sin datos previos: mejor un error que una tabla vacía
+
+    def obtener(self) -> pd.DataFrame:
+        self.asegurar()
+        return self.df.copy()
+
+    def invalidar(self):
+        self._gen_pedida += 1
+
+    def revalidar_en_segundo_plano(self, tras_escritura: bool = True):
+        with self._lock:
+            if self._revalidando:
+                # una escritura necesita otra vuelta: la bajada en curso puede ser previa
+                self._otra_vuelta = self._otra_vuelta or tras_escritura
+                return
+            self._revalidando = True
+
+        def _run():
+            while True:
+                try:
+                    self.sincronizar(forzar=True)
+                except Exception:
+                    pass
+                with self._lock:
+                    if not self._otra_vuelta:
+                        self._revalidando = False
+                        return
+                    self._otra_vuelta = False
+
+        threading.Thread(target=_run, daemon=True).start()
+
+    # ----- write-through -----
+    def _aplicar_op(self, op: str, arg):
+        if op == "upsert":
+            self.df = self._ordenar(upsert_por_id(self.df, arg))
+        elif op == "quitar" and not self.df.empty:
+            mask = pd.to_numeric(self.df["id"], errors="coerce").isin(arg)
+            self.df = self.df[~mask].reset_index(drop=True)
+        elif op == "parchar" and not self.df.empty:
+            # copia: el snapshot anterior puede estar en uso por otra sesión
+            df = self.df.copy()
+            ids = pd.to_numeric(df["id"], errors="coerce")
+            for _id, cambios in arg.items():
+                mask = ids == _id
+                for col, valor in cambios.items():
+                    df.loc[mask, col] = valor
+            self.df = df
+
+    def _escribir(self, op: str, arg):
+        with self._lock:
+            self._aplicar_op(op, arg)
+            self.version += 1
+            if self._diario is not None:
+                self._diario.append((op, arg))
+
+    def aplicar(self, filas):
+        """Mete en el snapshot las filas que devolvió un insert/update."""
+        # insert/update devuelven la fila entera: nos quedamos con lo proyectado
+        cols = columnas(self.tabla).split(",")
+        self._escribir("upsert", [{c: f.get(c) for c in cols if c in f} for f in filas])
+
+    def quitar(self, ids):
+        self._escribir("quitar", {int(i) for i in ids})
+
+    def parchar(self, cambios: dict):
+        """Pisa columnas sueltas de filas ya cacheadas: {id: {col: valor}} (valores absolutos)."""
+        self._escribir("parchar", {int(i): c for i, c in cambios.items()})
+
+
+class LedgerFinanzas(TablaCache):
+    """
+    `finanzas` sincronizada por delta.
+    Solo baja las filas con id mayor al último visto y las agrega al frame,
+    así un refresh cuesta lo mismo aunque el historial crezca.
+    Los borrados propios se aplican con `quitar()`; los hechos desde otro
+    lado se detectan con una reconciliación liviana (solo ids) cada tanto.
+    Esa misma reconciliación trae las filas con id por debajo de max_id que
+    no están en el frame (una transacción que tomó su id antes pero hizo
+    commit después de la última bajada).
+    """
+
+    def __init__(self):
+        super().__init__("finanzas")
+        # max_id solo avanza con lo que bajó del server (no con write-through),
+        # si no el delta se salta filas que otra sesión insertó en el medio
+        self.max_id = 0
+        self.reconciliado_en = 0.0
+
+    @staticmethod
+    def _pedir(bajar, *args) -> list:
+        try:
+            return bajar("finanzas", columnas("finanzas"), *args)
+        except Exception as e:
+            if not falta_columna(e):
+                raise
+            # migración sin correr todavía: bajamos lo que haya
+            return bajar("finanzas", "*", *args)
+
+    def _bajar(self):
+        ahora = time.time()
+        desde = self.max_id
+        nuevas = self._pedir(almacen.bajar, desde)
+        vivos, rezagadas = None, []
+        if desde == 0:
+            self.reconciliado_en = ahora
+        elif ahora - self.reconciliado_en >= FIN_RECONCILIAR_SEG:
+            vivos = {int(r["id"]) for r in almacen.bajar("finanzas", "id")}
+            locales = set(pd.to_numeric(self.df["id"], errors="coerce").dropna().astype(int)) if not self.df.empty else set()
+            faltan = {i for i in vivos if i <= desde} - locales
+            if faltan:
+                rezagadas = self._pedir(almacen.bajar_ids, faltan)
+            self.reconciliado_en = ahora
+        return nuevas + rezagadas, vivos
+
+    def _integrar(self, datos) -> bool:
+        nuevas, vivos = datos
+        cambio = False
+        if nuevas:
+            nuevo = pd.DataFrame(nuevas)
+            self.df = self._ordenar(upsert_por_id(self.df, nuevo))
+            self.max_id = max(self.max_id, int(pd.to_numeric(nuevo["id"], errors="coerce").max()))
+            cambio = True
+        if vivos is not None and not self.df.empty:
+            mask = pd.to_numeric(self.df["id"], errors="coerce").isin(vivos)
+            if not mask.all():
+                self.df = self.df[mask].reset_index(drop=True)
+                cambio = True
+        return cambio
+
+
+@st.cache_resource
+def tablas() -> dict:
+    return {
+        "inventario": TablaCache("inventario"),
+        "finanzas": LedgerFinanzas(),
+        "categorias": TablaCache("categorias", orden="nombre"),
+    }
+
+
+def invalidar(*nombres: str):
+    """Marca solo esas tablas para recargar (reemplaza al viejo st.cache_data.clear())."""
+    for n in nombres:
+        tablas()[n].invalidar()
+
+
+def escribir(tabla: str, filas):
+    """
+    Write-through: aplica al cache lo que devolvió el almacén (así el rerun
+    no espera a la red) y reconcilia con el server en segundo plano.
+    Una tabla que todavía no se cargó no se toca: se baja entera (con el
+    cambio incluido) cuando se muestre.
+    """
+    t = tablas()[tabla]
+    if not t.sincronizado_en:
+        return
+    if filas:
+        t.aplicar(filas)
+        t.revalidar_en_segundo_plano()
+    else:
+        t.invalidar()
+
+
+def quitar(tabla: str, ids):
+    t = tablas()[tabla]
+    if not t.sincronizado_en:
+        return
+    t.quitar(ids)
+    t.revalidar_en_segundo_plano()
+
+
+def escribir_movimiento_stock(data: dict) -> dict:
+    """
+    Las RPCs de stock (ajustar_stock / reponer_stock) devuelven
+    {"inventario": fila, "finanzas": fila}: write-through de las dos.
+    Devuelve la fila de inventario ya actualizada por el server.
+    """
+    escribir("inventario", [data["inventario"]])
+    escribir("finanzas", [data["finanzas"]])
+    return data["inventario"]
+
+
+class ConflictoEdicion(Exception):
+    """Otra sesión modificó la fila después de que la leímos."""
+
+
+def actualizar_si_no_cambio(tabla: str, row: dict, cambios: dict) -> list:
+    """
+    UPDATE condicional (compare-and-swap): solo pisa la fila si su `version`
+    sigue siendo la que leímos. Sin lock ni recarga previa; si otra sesión
+    escribió primero no se pierde su cambio: se levanta ConflictoEdicion.
+    """
+    filtros = {"id": int(row["id"])}
+    version = row.get("version")
+    if version is not None and not pd.isna(version):
+        filtros["version"] = int(version)
+    filas = almacen.actualizar(tabla, cambios, **filtros)
+    if not filas:
+        raise ConflictoEdicion()
+    return filas
+
+
+def reconciliar(*nombres: str):
+    """Revalida en segundo plano las tablas ya cargadas (las demás se bajan cuando se muestren)."""
+    for n in nombres:
+        t = tablas()[n]
+        if t.sincronizado_en:
+            t.revalidar_en_segundo_plano()
+
+
+def edad_datos_txt() -> str:
+    """Antigüedad de lo que se muestra: solo las tablas que cargó esta corrida."""
+    nombres = st.session_state.get("_tablas_carga", [])
+    seg = int(max((tablas()[n].edad() for n in nombres), default=0))
+    return f"datos de hace {seg} s" if seg < 60 else f"datos de hace {seg // 60} min"
+
+
+def cargar_todo(nombres: list):
+    """
+    Sincroniza en paralelo las tablas pedidas (el arranque en frío cuesta lo que la
+    más lenta, no la suma). No copia nada: cada vista toma lo suyo después
+    (obtener() o VistaDerivada). Deja los tiempos en session_state para el About.
+    """
+    ts = {n: tablas()[n] for n in nombres}
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(ts)) as pool:
+        for f in [pool.submit(t.asegurar) for t in ts.values()]:
+            f.result()
+    st.session_state["_tablas_carga"] = list(ts)
+    st.session_state["_tiempos_carga"] = {
+        "total_ms": (time.perf_counter() - t0) * 1000,
+        **{n: t.ultima_bajada_ms for n, t in tablas().items()},
+    }
+
+
 def cargar_inventario():
-    try:
-        res = supabase.table("inventario").select("*").execute()
-        return pd.DataFrame(res.data)
-    except:
-        return pd.DataFrame()
+    return tablas()["inventario"].obtener()
 
-@st.cache_data(ttl=60)
 def cargar_finanzas():
+    return tablas()["finanzas"].obtener()
+
+def cargar_categorias():
+    return tablas()["categorias"].obtener()
+
+
+# =========================================================
+# DIARIO LOCAL DE ESCRITURAS (ventas, gastos, ingresos, ajustes)
+# =========================================================
+DIARIO_ESPERA_MAX_SEG = 60   # tope del backoff mientras no hay conexión
+
+
+class DiarioEscrituras:
+    """
+    Write-ahead journal en SQLite. Cada operación se anota en disco antes de
+    tocar la red (el cobro no espera a Supabase) y un hilo las reenvía en
+    orden vía la RPC `ejecutar_idempotente`, con una clave única por
+    operación: un reintento después de un corte nunca la duplica.
+    Sin conexión, las operaciones esperan acá y salen solas cuando vuelve.
+    """
+
+    def __init__(self, ruta: str, almacen: Repositorio, tablas: dict):
+        self.ruta = ruta
+        self.almacen = almacen
+        self.tablas = tablas
+        self.ultimo_error = None
+        self._despertar = threading.Event()
+        self._sql("pragma journal_mode=wal")
+        self._sql("""
+            create table if not exists diario (
+                seq integer primary key autoincrement,
+                clave text not null unique,
+                op text not null,
+                args text not null,
+                resumen text not null,
+                estado text not null default 'pendiente',  -- pendiente | fallida
+                intentos integer not null default 0,
+                error text,
+                creada_en real not null
+            )
+        """)
+        self._despertar.set()  # lo que quedó pendiente de antes de reiniciar sale ya
+        threading.Thread(target=self._bucle, daemon=True).start()
+
+    def _sql(self, sql: str, params=()) -> list:
+        db = sqlite3.connect(self.ruta, timeout=10)
+        try:
+            with db:  # commit (o rollback) al salir
+                return db.execute(sql, params).fetchall()
+        finally:
+            db.close()
+
+    # ----- lado de la app -----
+    def agregar(self, op: str, args: dict, resumen: str) -> str:
+        clave = str(uuid.uuid4())
+        if op in ("venta", "ajuste"):
+            # la fecha es la de la operación, no la del envío (puede salir horas después)
+            args = {**args, "p_fecha": now_ar_str()}
+        self._sql(
+            "insert into diario (clave, op, args, resumen, creada_en) values (?, ?, ?, ?, ?)",
+            (clave, op, json.dumps(args), resumen, time.time()),
+        )
+        self._despertar.set()
+        return clave
+
+    def pendientes(self) -> int:
+        return self._sql("select count(*) from diario where estado = 'pendiente'")[0][0]
+
+    def fallidas(self) -> list:
+        filas = self._sql("select seq, resumen, error from diario where estado = 'fallida' order by seq")
+        return [{"seq": seq, "resumen": resumen, "error": error} for seq, resumen, error in filas]
+
+    def reintentar(self, seq: int):
+        self._sql("update diario set estado = 'pendiente', error = null where seq = ?", (seq,))
+        self._despertar.set()
+
+    def descartar(self, seq: int):
+        self._sql("delete from diario where seq = ? and estado = 'fallida'", (seq,))
+
+    # ----- hilo de envío -----
+    def _bucle(self):
+        espera = None
+        while True:
+            self._despertar.wait(espera)
+            self._despertar.clear()
+            try:
+                self.despachar()
+                self.ultimo_error = None
+                espera = None
+            except Exception as e:
+                # sin red: se reintenta con backoff exponencial (o antes si llega otra operación)
+                self.ultimo_error = str(e)
+                espera = min(DIARIO_ESPERA_MAX_SEG, (espera or 0.5) * 2)
+
+    def despachar(self):
+        """Envía las pendientes en orden. Corta (y levanta) ante una falla transitoria."""
+        filas = self._sql("select seq, clave, op, args from diario where estado = 'pendiente' order by seq")
+        for seq, clave, op, args in filas:
+            try:
+                res = self._enviar(clave, op, json.loads(args))
+            except Exception as e:
+                if es_transitorio(e):
+                    self._sql("update diario set intentos = intentos + 1, error = ? where seq = ?", (str(e), seq))
+                    raise
+                # el server la rechazó (ej. stock insuficiente): no bloquea al resto
+                self._sql("update diario set estado = 'fallida', intentos = intentos + 1, error = ? where seq = ?", (str(e), seq))
+                self._integrar(op, None)  # deshace el descuento optimista trayendo lo real
+                continue
+            self._sql("delete from diario where seq = ?", (seq,))
+            self._integrar(op, res)
+
+    def _enviar(self, clave: str, op: str, args: dict):
+        try:
+            return self.almacen.rpc("ejecutar_idempotente", {"p_clave": clave, "p_op": op, "p_args": args})
+        except Exception as e:
+            if not falta_funcion(e):
+                raise
+        # sin sql/006 todavía: mismo efecto, sin protección contra duplicados
+        if op == "finanzas":
+            return (self.almacen.insertar("finanzas", args) or [None])[0]
+        fn = "registrar_venta_carrito" if op == "venta" else "ajustar_stock"
+        try:
+            return self.almacen.rpc(fn, args)
+        except Exception as e:
+            if "p_fecha" not in args or not falta_funcion(e):
+                raise
+        # versión sin p_fecha: el movimiento queda con la hora del envío
+        return self.almacen.rpc(fn, {k: v for k, v in args.items() if k != "p_fecha"})
+
+    def _integrar(self, op: str, res):
+        """Write-through con lo que devolvió el server (mismo criterio que escribir())."""
+        if op == "finanzas" and res:
+            cambios = {"finanzas": [res]}
+        elif op == "ajuste" and res:
+            cambios = {"inventario": [res["inventario"]], "finanzas": [res["finanzas"]]}
+        else:
+            cambios = {"inventario": None, "finanzas": None}  # venta (o rechazo): recargar lo cargado
+        for nombre, filas in cambios.items():
+            t = self.tablas[nombre]
+            if not t.sincronizado_en:
+                continue  # sin cargar (ej. finanzas fuera de su sección): se baja al mostrarla
+            if filas:
+                t.aplicar(filas)
+            t.revalidar_en_segundo_plano()
+
+
+@st.cache_resource
+def diario() -> DiarioEscrituras:
+    return DiarioEscrituras(secreto("DIARIO_PATH", ruta_local(".ilara_diario.sqlite3")), almacen, tablas())
+
+
+def panel_diario():
+    """Aviso de operaciones que todavía no llegaron a Supabase (y las rechazadas)."""
+    d = diario()
+    n = d.pendientes()
+    if n:
+        st.info(f"⏳ {n} operación(es) guardadas en este equipo, {d.almacen.pista_espera}. Se envían solas.")
+    for f in d.fallidas():
+        with st.expander(f"❌ No se pudo registrar: {f['resumen']}"):
+            st.caption(f["error"] or "")
+            c1, c2 = st.columns(2)
+            if c1.button("🔄 Reintentar", key=f"diario_re_{f['seq']}", use_container_width=True):
+                d.reintentar(f["seq"])
+                st.rerun()
+            if c2.button("🗑️ Descartar", key=f"diario_del_{f['seq']}", use_container_width=True):
+                d.descartar(f["seq"])
+                st.rerun()
+
+
+# =========================================================
+# VISTAS DERIVADAS (se rearman solo si cambia la versión de sus tablas)
+# =========================================================
+class VistaDerivada:
+    """
+    Resultado calculado a partir de una o más tablas cacheadas, compartido
+    entre sesiones. Se reconstruye solo cuando cambia la versión de alguna
+    de sus tablas fuente; el resultado es de solo lectura.
+    """
+
+    def __init__(self, fuentes: list, construir):
+        self.fuentes = fuentes
+        self.construir = construir
+        self.version = None
+        self.valor = None
+        self._lock = threading.Lock()
+
+    def obtener(self):
+        snaps = [tablas()[f].snapshot() for f in self.fuentes]
+        version = tuple(v for _, v in snaps)
+        with self._lock:
+            if version != self.version:
+                self.valor = self.construir(*[df for df, _ in snaps])
+                self.version = version
+            return self.valor
+
+
+# =========================================================
+# INVENTARIO: vista normalizada + índice de productos
+# =========================================================
+def normalizar_inventario(df_inv: pd.DataFrame, df_cats: pd.DataFrame) -> pd.DataFrame:
+    """Blindajes del inventario (tipos, nombre de categoría, display y key)."""
+    if df_inv.empty:
+        return df_inv.copy()
+    df_inv = df_inv.copy()
+
+    cat_id_to_name = {}
+    if not df_cats.empty and {"id", "nombre"} <= set(df_cats.columns):
+        ids = pd.to_numeric(df_cats["id"], errors="coerce")
+        cat_id_to_name = {
+            int(i): str(n).strip() for i, n in zip(ids, df_cats["nombre"])
+            if pd.notna(i) and str(n).strip()
+        }
+
+    # columnas base
+    for col in ["producto", "marca"]:
+        if col not in df_inv.columns:
+            df_inv[col] = ""
+        df_inv[col] = df_inv[col].astype(str)
+
+    # categoria_id (si existe)
+    if "categoria_id" in df_inv.columns:
+        df_inv["categoria_id"] = pd.to_numeric(df_inv["categoria_id"], errors="coerce")
+
+    # categoria "nombre" (compat: si todavía existe texto en inventario)
+    if "categoria" not in df_inv.columns:
+        df_inv["categoria"] = ""
+    df_inv["categoria"] = df_inv["categoria"].astype(str)
+
+    # Si hay categoria_id, usamos el nombre de la tabla categorias
+    if "categoria_id" in df_inv.columns and cat_id_to_name:
+        nombre_cat = df_inv["categoria_id"].map(cat_id_to_name).fillna("")
+        df_inv["categoria"] = nombre_cat.where(nombre_cat.str.len() > 0, df_inv["categoria"])
+
+    df_inv["display"] = df_inv["producto"] + " - " + df_inv["marca"]
+
+    df_inv["stock"] = pd.to_numeric(df_inv.get("stock", 0), errors="coerce").fillna(0).astype(int)
+    df_inv["precio_costo"] = pd.to_numeric(df_inv.get("precio_costo", 0), errors="coerce").fillna(0.0)
+    df_inv["precio_venta"] = pd.to_numeric(df_inv.get("precio_venta", 0), errors="coerce").fillna(0.0)
+
+    # código de barras / SKU (vacío si no tiene o si falta la migración)
+    if "codigo" not in df_inv.columns:
+        df_inv["codigo"] = ""
+    df_inv["codigo"] = df_inv["codigo"].fillna("").astype(str).str.strip().str.upper()
+
+    # versión de la fila para escrituras condicionales (None si falta la migración)
+    if "version" in df_inv.columns:
+        df_inv["version"] = pd.to_numeric(df_inv["version"], errors="coerce").astype("Int64")
+
+    # key local robusta (para duplicados)
+    df_inv["key"] = df_inv["producto"].str.strip().str.lower() + "_" + df_inv["marca"].str.strip().str.lower()
+    return df_inv
+
+
+def normalizar_codigo(codigo) -> str:
+    return str(codigo or "").strip().upper()
+
+
+def plegar(texto) -> str:
+    """minúsculas y sin tildes: 'Rímel' -> 'rimel'."""
+    t = unicodedata.normalize("NFKD", str(texto or "")).lower()
+    return "".join(c for c in t if not unicodedata.combining(c))
+
+
+def tokenizar(texto) -> list:
+    return re.findall(r"[a-z0-9]+", plegar(texto))
+
+
+class IndiceBusqueda:
+    """
+    Índice invertido del inventario para el buscador (sin tildes, sin mayúsculas).
+    Cada término de la búsqueda matchea tokens por igualdad, por prefijo
+    (bisect sobre los tokens ordenados) o por substring vía trigramas; los
+    resultados se rankean por calidad del match y campo (producto > marca > categoría).
+    """
+
+    PESOS = {"producto": 3, "codigo": 3, "marca": 2, "categoria": 1}
+    EXACTO, PREFIJO, SUBSTRING = 3, 2, 1
+
+    def __init__(self, df: pd.DataFrame):
+        self.postings = {}   # token -> {posición: peso del mejor campo}
+        for campo, peso in self.PESOS.items():
+            if campo not in df.columns:
+                continue
+            for pos, valor in enumerate(df[campo].tolist()):
+                for tok in tokenizar(valor):
+                    filas = self.postings.setdefault(tok, {})
+                    if filas.get(pos, 0) < peso:
+                        filas[pos] = peso
+        self.tokens = sorted(self.postings)
+        self.trigramas = {}  # trigrama -> tokens que lo contienen
+        for tok in self.tokens:
+            for i in range(len(tok) - 2):
+                self.trigramas.setdefault(tok[i:i + 3], set()).add(tok)
+
+    def _tokens_para(self, termino: str) -> dict:
+        """token -> calidad del match para un término."""
+        encontrados = {}
+        i = bisect_left(self.tokens, termino)
+        while i < len(self.tokens) and self.tokens[i].startswith(termino):
+            tok = self.tokens[i]
+            encontrados[tok] = self.EXACTO if tok == termino else self.PREFIJO
+            i += 1
+        if len(termino) >= 3:
+            tris = [self.trigramas.get(termino[j:j + 3], set()) for j in range(len(termino) - 2)]
+            for tok in set.intersection(*tris):
+                if tok not in encontrados and termino in tok:
+                    encontrados[tok] = self.SUBSTRING
+        return encontrados
+
+    def buscar(self, consulta: str, limite: int = None) -> list:
+        """Posiciones de filas que matchean todos los términos, de mejor a peor."""
+        terminos = tokenizar(consulta)
+        if not terminos:
+            return []
+        puntajes = None
+        for termino in terminos:
+            del_termino = {}
+            for tok, calidad in self._tokens_para(termino).items():
+                for pos, peso in self.postings[tok].items():
+                    p = calidad * peso
+                    if del_termino.get(pos, 0) < p:
+                        del_termino[pos] = p
+            if puntajes is None:
+                puntajes = del_termino
+            else:
+                puntajes = {pos: puntajes[pos] + p for pos, p in del_termino.items() if pos in puntajes}
+            if not puntajes:
+                return []
+        orden = sorted(puntajes, key=lambda pos: (-puntajes[pos], pos))
+        return orden[:limite] if limite else orden
+
+
+class IndiceProductos:
+    """
+    Inventario normalizado + mapas O(1) por id, key y código + buscador.
+    Se arma una vez por versión de inventario/categorías; las filas son dicts
+    de solo lectura (row["stock"], row.get(...) igual que con una Series).
+    """
+
+    def __init__(self, df_inv: pd.DataFrame, df_cats: pd.DataFrame):
+        self.df = normalizar_inventario(df_inv, df_cats)
+        filas = self.df.to_dict("records") if not self.df.empty else []
+        self.ids = [int(r["id"]) for r in filas]
+        self.por_id = dict(zip(self.ids, filas))
+        self.por_key = {}
+        self.por_codigo = {}
+        for r in filas:
+            self.por_key.setdefault(r["key"], []).append(r)
+            if r.get("codigo"):
+                self.por_codigo.setdefault(r["codigo"], r)
+        self.busqueda = IndiceBusqueda(self.df)
+
+    def duplicado(self, key: str, excepto_id: int = None) -> bool:
+        return any(int(r["id"]) != excepto_id for r in self.por_key.get(key, []))
+
+    def codigo_ocupado(self, codigo: str, excepto_id: int = None) -> bool:
+        r = self.por_codigo.get(normalizar_codigo(codigo))
+        return r is not None and int(r["id"]) != excepto_id
+
+
+def indice_productos() -> IndiceProductos:
+    return vistas()["inventario"].obtener()
+
+
+# =========================================================
+# FINANZAS: vista normalizada (una vez por versión)
+# =========================================================
+COLUMNAS_LEDGER = ["id", "fecha", "tipo", "descripcion", "monto"]
+
+
+def normalizar_ledger(df: pd.DataFrame, completo: bool = False) -> pd.DataFrame:
+    """
+    Ledger listo para filtrar y mostrar: id entero, monto numérico y
+    fecha_dt / fecha_fmt / mes / monto_fmt / etiqueta ya calculados, ordenado por id DESC.
+    `completo`: df es todo el ledger (no un resultado de búsqueda).
+    """
+    if df.empty:
+        return pd.DataFrame(columns=COLUMNAS_LEDGER + ["fecha_dt", "fecha_fmt", "mes", "monto_fmt", "etiqueta"])
+
+    out = df.copy()
+    for col in COLUMNAS_LEDGER:
+        if col not in out.columns:
+            out[col] = None
+    out["id"] = pd.to_numeric(out["id"], errors="coerce")
+    out = out.dropna(subset=["id"])
+    out["id"] = out["id"].astype(int)
+    out["descripcion"] = out["descripcion"].fillna("").astype(str)
+    out["tipo"] = out["tipo"].fillna("").astype(str)
+    out["monto"] = pd.to_numeric(out["monto"], errors="coerce").fillna(0.0)
+
+    out = formatear_fecha_arg(out, completo)
+    out["mes"] = out["fecha_dt"].dt.strftime("%Y-%m")
+    out["monto_fmt"] = formatear_montos_ars(out["monto"])
+    out["etiqueta"] = etiquetas_movimientos(out)
+    return out.sort_values("id", ascending=False).reset_index(drop=True)
+
+
+def ledger_normalizado() -> pd.DataFrame:
+    """Frame compartido entre sesiones: no modificarlo in place."""
+    return vistas()["ledger"].obtener()
+
+
+@st.cache_resource
+def vistas() -> dict:
+    return {
+        "inventario": VistaDerivada(["inventario", "categorias"], IndiceProductos),
+        "ledger": VistaDerivada(["finanzas"], lambda df: normalizar_ledger(df, completo=True)),
+    }
+
+
+# =========================================================
+# FINANZAS: meses y búsqueda
+# =========================================================
+@st.cache_data(ttl=CACHE_TTL, max_entries=8, show_spinner=False)
+def meses_finanzas(version: int, _df_local: pd.DataFrame) -> list:
+    """Meses con movimientos (YYYY-MM, más nuevo primero), una vez por versión del ledger."""
+    return sorted(_df_local["mes"].dropna().unique().tolist(), reverse=True)
+
+
+def parsear_monto(texto: str):
+    """'1500', '$ 1.500', '1500,50' -> float; None si no es un monto."""
+    t = texto.replace("$", "").replace(" ", "")
+    if not re.fullmatch(r"-?\d+([.,]\d+)*", t):
+        return None
+    if "," in t:
+        t = t.replace(".", "").replace(",", ".")
+    elif re.fullmatch(r"-?\d{1,3}(\.\d{3})+", t):
+        t = t.replace(".", "")
     try:
-        res = supabase.table("finanzas").select("*").execute()
-        return pd.DataFrame(res.data)
-    except:
-        return pd.DataFrame()
+        return float(t)
+    except ValueError:
+        return None
 
 
-@st.cache_data(ttl=60)
-def cargar_categorias():
+def terminos_busqueda(busq: str) -> list:
+    """
+    "labial / 1.500,50" -> [(texto, monto o None), ...]: lo que buscan los dos almacenes.
+    El monto se parsea del término crudo (la coma decimal es parte del número);
+    el texto sale sin , ( ) " * % \\ (sintaxis de PostgREST / LIKE).
+    """
+    terminos = []
+    for crudo in busq.split("/"):
+        monto = parsear_monto(crudo.strip())
+        texto = re.sub(r'[,()"*%\\]', " ", crudo).strip()
+        if texto:
+            terminos.append((texto, monto))
+    return terminos
+
+
+def filtros_busqueda(busq: str) -> list:
+    """
+    "labial / 1500 / efectivo" -> un filtro `or` de PostgREST por término (se combinan con AND).
+    Los montos matchean el importe exacto (con o sin signo: los gastos son negativos);
+    el texto matchea descripción, tipo o método de pago.
+    """
+    filtros = []
+    for texto, monto in terminos_busqueda(busq):
+        patron = f'"*{texto}*"'
+        if monto is not None:
+            # repr(): el float completo (":g" redondea a 6 dígitos y 150000.5 deja de matchear)
+            filtros.append(f"monto.eq.{monto!r},monto.eq.{-monto!r},descripcion.ilike.{patron}")
+        else:
+            filtros.append(f"descripcion.ilike.{patron},tipo.ilike.{patron},metodo_pago.ilike.{patron}")
+    return filtros
+
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=64, show_spinner=False)
+def buscar_movimientos(busq: str, version: int, limite: int) -> pd.DataFrame:
+    """Los `limite` movimientos más nuevos que matchean la búsqueda, en un solo viaje al server."""
+    cols = columnas("finanzas")
     try:
-        res = supabase.table("categorias").select("*").order("nombre").execute()
-        return pd.DataFrame(res.data)
-    except:
-        return pd.DataFrame()
+        filas = almacen.buscar_finanzas(busq, cols, limite)
+    except Exception as e:
+        if not falta_columna(e):
+            raise
+        filas = almacen.buscar_finanzas(busq, "*", limite)  # migración sin correr todavía
+    return normalizar_ledger(pd.DataFrame(filas, columns=cols.split(",")))
+
+
+def paginador(total: int, clave: str) -> tuple:
+    """Controles de página (tamaño, anterior/siguiente, ir a). Devuelve (tam, página)."""
+    c_tam, c_prev, c_pag, c_next = st.columns(4, vertical_alignment="bottom")
+    tam = c_tam.selectbox("Filas por página", TAMANIOS_PAGINA, index=1, key=f"{clave}_tam")
+    paginas = max(1, -(-total // tam))
+
+    k = f"{clave}_n"
+    if st.session_state.get(k, 1) > paginas:
+        st.session_state[k] = paginas
+    actual = st.session_state.get(k, 1)
+
+    def _mover(delta: int):
+        st.session_state[k] = min(paginas, max(1, st.session_state.get(k, 1) + delta))
+
+    c_prev.button("◀ Anterior", key=f"{clave}_prev", on_click=_mover, args=(-1,),
+                  disabled=actual <= 1, use_container_width=True)
+    pagina = c_pag.number_input(f"Página (de {paginas})", min_value=1, max_value=paginas, step=1, key=k)
+    c_next.button("Siguiente ▶", key=f"{clave}_next", on_click=_mover, args=(1,),
+                  disabled=actual >= paginas, use_container_width=True)
+    return tam, int(pagina)
+
+
+def selector_producto(indice: IndiceProductos, etiqueta: str, clave: str):
+    """
+    Buscador + selectbox con los primeros MAX_OPCIONES_SELECTOR resultados.
+    Al browser solo viajan esos k productos, no el catálogo entero.
+    Devuelve la fila elegida (dict) o None.
+    """
+    q = st.text_input(f"🔍 {etiqueta}", key=f"{clave}_q", placeholder="Escribí nombre, marca o categoría").strip()
+    if q:
+        ids = [indice.ids[pos] for pos in indice.busqueda.buscar(q, limite=MAX_OPCIONES_SELECTOR)]
+        if not ids:
+            st.info("Ningún producto coincide con la búsqueda.")
+            return None
+    else:
+        ids = indice.ids[:MAX_OPCIONES_SELECTOR]
+        if len(indice.ids) > len(ids):
+            st.caption(f"Mostrando {len(ids)} de {len(indice.ids)} productos. Escribí para buscar el resto.")
+
+    id_sel = st.selectbox(
+        etiqueta,
+        options=ids,
+        format_func=lambda _id: indice.por_id[_id]["display"],
+        key=clave,
+    )
+    return indice.por_id.get(id_sel)
+
+
+def sumar_al_carrito(row: dict, cantidad: int, subtotal: float = None):
+    """Suma el producto al carrito; si ya está, acumula cantidad y subtotal."""
+    carrito = st.session_state.setdefault("carrito", {})
+    id_prod = int(row["id"])
+    precio_unit = float(row["precio_venta"])
+    if subtotal is None:
+        subtotal = precio_unit * int(cantidad)
+
+    it = carrito.get(id_prod)
+    if it:
+        it["cantidad"] = int(it["cantidad"]) + int(cantidad)
+        it["subtotal"] = float(it.get("subtotal", 0.0)) + float(subtotal)
+        it["precio_unit"] = precio_unit  # por las dudas
+        it["display"] = row["display"]
+    else:
+        carrito[id_prod] = {
+            "producto_id": id_prod,
+            "display": row["display"],
+            "cantidad": int(cantidad),
+            "precio_unit": precio_unit,
+            "subtotal": float(subtotal),
+        }
+
+
+def disponible(row: dict) -> int:
+    """Stock cacheado menos lo que ya está reservado en el carrito de esta sesión."""
+    en_carrito = st.session_state.get("carrito", {}).get(int(row["id"]), {}).get("cantidad", 0)
+    return int(row["stock"]) - int(en_carrito)
+
+
+def escanear_codigo():
+    """
+    Callback del modo caja: '7791234' suma 1, '3*7791234' suma 3.
+    Resuelve el código con el mapa O(1) del índice y deja el campo vacío
+    para el próximo escaneo (sin botón ni st.rerun por ítem).
+    """
+    texto = st.session_state.get("cart_codigo", "").strip()
+    st.session_state["cart_codigo"] = ""
+    if not texto:
+        return
+
+    cant = 1
+    if "*" in texto:
+        n, texto = (x.strip() for x in texto.split("*", 1))
+        if not n.isdigit() or int(n) <= 0:
+            # mejor no sumar nada que sumar 1 de algo que no se pidió así
+            st.session_state["cart_caja_msg"] = ("warning", f"⚠️ Cantidad inválida «{n}»: no se agregó nada.")
+            return
+        cant = int(n)
+
+    row = indice_productos().por_codigo.get(normalizar_codigo(texto))
+    if row is None:
+        st.session_state["cart_caja_msg"] = ("error", f"❌ Código desconocido: {texto}")
+        return
+
+    libres = disponible(row)
+    if cant > libres:
+        st.session_state["cart_caja_msg"] = ("error", f"❌ Sin stock suficiente de {row['display']} (disponibles {max(0, libres)}).")
+        return
+
+    sumar_al_carrito(row, cant)
+    st.session_state["cart_caja_msg"] = ("success", f"✅ +{cant} {row['display']}")
 
 # =========================================================
-# UI HEADER + FOOTER
+# DATA (con spinner) + FOOTER
 # =========================================================
+seccion = st.session_state.get("seccion") or SECCIONES[0]
+
+# Streamlit borra el estado de los widgets que no se dibujan en el rerun:
+# re-asignar el de las secciones ocultas lo conserva hasta volver a ellas.
+for _sec, _prefijos in ESTADO_POR_SECCION.items():
+    if _sec == seccion:
+        continue
+    for _k in list(st.session_state.keys()):
+        if isinstance(_k, str) and _k.startswith(_prefijos) and not _k.endswith(("_prev", "_next")):
+            st.session_state[_k] = st.session_state[_k]
+
+with st.spinner("Cargando Ilara Beauty..."):
+    try:
+        # finanzas solo viaja si la sección la muestra
+        cargar_todo(["inventario", "categorias", *TABLAS_POR_SECCION.get(seccion, [])])
+    except Exception as e:
+        # nunca mostrar un inventario vacío por una falla de red
+        st.error(f"❌ No pudimos traer los datos de {almacen.nombre} ({almacen.pista_falla}).\n\n{e}")
+        st.button("🔄 Reintentar", type="primary")
+        st.stop()
+    df_inv = cargar_inventario()
+    df_cats = cargar_categorias()
 
-# Footer fijo (premium)
+# Footer fijo (premium) con la edad de los datos
 st.markdown(
-    """
+    f"""
     <style>
-    .footer-fixed {
+    .footer-fixed {{
         position: fixed;
         left: 0;
         bottom: 0;
@@ -377,21 +2049,13 @@ st.markdown(
         background: rgba(0,0,0,0.0);
         z-index: 999;
         pointer-events: none;
-    }
+    }}
     </style>
-    <div class="footer-fixed">by Ilan con amor · v3.6.1</div>
+    <div class="footer-fixed">by Ilan con amor · v3.6.1 · {edad_datos_txt()}</div>
     """,
     unsafe_allow_html=True
 )
 
-# =========================================================
-# DATA (con spinner)
-# =========================================================
-with st.spinner("Cargando Ilara Beauty..."):
-    df_inv = cargar_inventario()
-    df_fin = cargar_finanzas()
-    df_cats = cargar_categorias()
-
 # Header marca (premium)
 
 # =========================================================
@@ -408,10 +2072,14 @@ if not df_cats.empty:
     df_cats = df_cats[df_cats["nombre"] != ""].copy()
 
 cat_name_to_id = {r["nombre"]: int(r["id"]) for _, r in df_cats.iterrows()} if not df_cats.empty else {}
-cat_id_to_name = {int(r["id"]): r["nombre"] for _, r in df_cats.iterrows()} if not df_cats.empty else {}
 
 categorias_list = sorted(cat_name_to_id.keys()) if cat_name_to_id else DEFAULT_CATEGORIAS
 
+# Inventario normalizado + índice: se arma una vez por versión y se comparte
+# entre sesiones (df_inv es de solo lectura)
+indice = indice_productos()
+df_inv = indice.df
+
 stock_crit = 0
 if not df_inv.empty and "stock" in df_inv.columns:
     try:
@@ -456,58 +2124,20 @@ st.markdown(
     unsafe_allow_html=True
 )
 
-# Blindajes inventario
-if not df_inv.empty:
-    # columnas base
-    for col in ["producto", "marca"]:
-        if col not in df_inv.columns:
-            df_inv[col] = ""
-        df_inv[col] = df_inv[col].astype(str)
-
-    # categoria_id (si existe)
-    if "categoria_id" in df_inv.columns:
-        df_inv["categoria_id"] = pd.to_numeric(df_inv["categoria_id"], errors="coerce")
-
-    # categoria "nombre" (compat: si todavía existe texto en inventario)
-    if "categoria" not in df_inv.columns:
-        df_inv["categoria"] = ""
-    df_inv["categoria"] = df_inv["categoria"].astype(str)
-
-    # Si hay categoria_id, usamos el nombre de la tabla categorias
-    if "categoria_id" in df_inv.columns and cat_id_to_name:
-        df_inv["categoria"] = df_inv["categoria_id"].apply(lambda x: cat_id_to_name.get(int(x), "") if pd.notna(x) else "")                               .where(lambda s: s.astype(str).str.len() > 0, df_inv["categoria"])
-
-    df_inv["display"] = df_inv["producto"] + " - " + df_inv["marca"]
-
-    df_inv["stock"] = pd.to_numeric(df_inv.get("stock", 0), errors="coerce").fillna(0).astype(int)
-    df_inv["precio_costo"] = pd.to_numeric(df_inv.get("precio_costo", 0), errors="coerce").fillna(0.0)
-    df_inv["precio_venta"] = pd.to_numeric(df_inv.get("precio_venta", 0), errors="coerce").fillna(0.0)
-
-    # key local robusta (para duplicados)
-    df_inv["key"] = df_inv["producto"].str.strip().str.lower() + "_" + df_inv["marca"].str.strip().str.lower()
-
-
-# Blindajes finanzas
-if not df_fin.empty:
-    if "descripcion" not in df_fin.columns:
-        df_fin["descripcion"] = ""
-    df_fin["descripcion"] = df_fin["descripcion"].astype(str)
-    df_fin["monto"] = pd.to_numeric(df_fin.get("monto", 0), errors="coerce").fillna(0.0)
-
-    for col in ["producto_id", "cantidad", "metodo_pago"]:
-        if col not in df_fin.columns:
-            df_fin[col] = None
+# operaciones del diario local que siguen sin llegar al server
+panel_diario()
 
 # =========================================================
-# TABS (tradicional)
+# NAVEGACIÓN (solo se ejecuta la sección elegida)
 # =========================================================
-tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(
-    ["📦 Inventario", "💰 Nueva Venta", "💸 Nuevo Gasto", "📊 Finanzas", "🏷️ Categorías", "💌 About"]
+seccion = st.segmented_control(
+    "Sección", SECCIONES, default=SECCIONES[0], required=True,
+    key="seccion", label_visibility="collapsed",
 )
 # =========================================================
 # TAB 1: INVENTARIO
 # =========================================================
-with tab1:
+if seccion == "📦 Inventario":
     st.header("📦 Gestión de Productos")
 
     if df_inv.empty:
@@ -525,68 +2155,65 @@ with tab1:
 
     st.divider()
 
-    sub_ver, sub_add, sub_edit, sub_ajuste, sub_del = st.tabs(
-        ["🔍 Buscar", "➕ Agregar/Reponer", "✏️ Editar", "📉 Ajuste", "🗑️ Eliminar"]
+    sub = st.segmented_control(
+        "Acción", SUB_INVENTARIO, default=SUB_INVENTARIO[0], required=True,
+        key="inv_sub", label_visibility="collapsed",
     )
 
-    # Buscar
-    with sub_ver:
-        if df_inv.empty:
-            st.info("No hay productos.")
-        else:
-            c1, c2 = st.columns([2, 1])
-            term = c1.text_input("🔍 Buscar por nombre o marca", placeholder="Ej: Rimel")
-            cats = sorted(df_inv["categoria"].dropna().unique().tolist())
-            filt_cat = c2.multiselect("Filtrar categoría", cats)
-
-            view = df_inv.copy()
-            if term:
-                view = view[view["display"].str.contains(term, case=False, na=False)]
-            if filt_cat:
-                view = view[view["categoria"].isin(filt_cat)]
-
-            view["ganancia"] = view["precio_venta"] - view["precio_costo"]
-
-            view_show = view[["producto", "marca", "categoria", "stock", "precio_costo", "precio_venta", "ganancia"]].copy()
-            view_show.rename(columns={
-                "producto": "Producto",
-                "marca": "Marca",
-                "categoria": "Categoría",
-                "stock": "Stock",
-                "precio_costo": "Costo",
-                "precio_venta": "Venta",
-                "ganancia": "Ganancia"
-            }, inplace=True)
-
-            # Estado (chips)
-            def _estado_stock(s):
-                try:
-                    s = int(s)
-                except Exception:
-                    s = 0
-                if s <= 0:
-                    return "🛑 Agotado"
-                if s <= 3:
-                    return "⚠️ Bajo"
-                return "✅ OK"
-
-            view_show["Estado"] = view_show["Stock"].apply(_estado_stock)
-
-            st.dataframe(view_show, use_container_width=True, hide_index=True)
-
-            # Export CSV
-            csv_inv = view_show.to_csv(index=False).encode("utf-8")
-            st.download_button(
-                "⬇️ Exportar inventario filtrado (CSV)",
-                csv_inv,
-                file_name="ilara_inventario.csv",
-                mime="text/csv",
-                use_container_width=True,
-            )
+    # Buscar (fragmento: tipear o filtrar re-ejecuta solo este bloque)
+    if sub == "🔍 Buscar":
+        @st.fragment
+        def buscador_inventario():
+            indice = indice_productos()
+            df_inv = indice.df
+            if df_inv.empty:
+                st.info("No hay productos.")
+            else:
+                c1, c2 = st.columns([2, 1])
+                term = c1.text_input("🔍 Buscar por nombre, marca o categoría", placeholder="Ej: Rimel")
+                cats = sorted(df_inv["categoria"].dropna().unique().tolist())
+                filt_cat = c2.multiselect("Filtrar categoría", cats)
+
+                view = df_inv.copy()
+                if term:
+                    # índice sin tildes (rimel == rímel), ordenado por relevancia
+                    view = df_inv.iloc[indice.busqueda.buscar(term)].copy()
+                if filt_cat:
+                    view = view[view["categoria"].isin(filt_cat)]
+
+                view["ganancia"] = view["precio_venta"] - view["precio_costo"]
+
+                view_show = view[["producto", "marca", "categoria", "stock", "precio_costo", "precio_venta", "ganancia"]].copy()
+                view_show.rename(columns={
+                    "producto": "Producto",
+                    "marca": "Marca",
+                    "categoria": "Categoría",
+                    "stock": "Stock",
+                    "precio_costo": "Costo",
+                    "precio_venta": "Venta",
+                    "ganancia": "Ganancia"
+                }, inplace=True)
+
+                # Estado (chips)
+                view_show["Estado"] = estado_stock(view_show["Stock"])
+
+                st.dataframe(view_show, use_container_width=True, hide_index=True)
+
+                # Export CSV
+                csv_inv = view_show.to_csv(index=False).encode("utf-8")
+                st.download_button(
+                    "⬇️ Exportar inventario filtrado (CSV)",
+                    csv_inv,
+                    file_name="ilara_inventario.csv",
+                    mime="text/csv",
+                    use_container_width=True,
+                )
+
+        buscador_inventario()
 
 
     # Agregar / reponer
-    with sub_add:
+    if sub == "➕ Agregar/Reponer":
         with st.form("form_add", clear_on_submit=True):
             st.caption("Si Nombre+Marca ya existe, suma stock.")
             a, b = st.columns(2)
@@ -599,6 +2226,7 @@ with tab1:
 
             costo = a.number_input("Costo ($)", min_value=0.0, value=None, placeholder="0,00")
             venta = b.number_input("Venta ($)", min_value=0.0, value=None, placeholder="0,00")
+            codigo = normalizar_codigo(a.text_input("Código de barras / SKU (opcional)"))
 
             if st.form_submit_button("Guardar"):
                 if not nom or costo is None or venta is None:
@@ -606,21 +2234,28 @@ with tab1:
                 else:
                     try:
                         key_in = nom.lower() + "_" + marca_final.lower()
-                        match = df_inv[df_inv["key"] == key_in] if not df_inv.empty else pd.DataFrame()
-
-                        if not match.empty:
-                            prod = match.iloc[0]
-                            new_stock = int(prod["stock"]) + int(cant)
-                            supabase.table("inventario").update({
-                                "stock": new_stock,
-                                "precio_costo": float(costo),
-                                "precio_venta": float(venta),
-                                "categoria": cat,
-                                "categoria_id": int(cat_name_to_id.get(cat, 0)) if cat_name_to_id.get(cat) else None
-                            }).eq("id", int(prod["id"])).execute()
-                            queue_toast(f"🔄 Stock actualizado: {prod['stock']} ➝ {new_stock}", "✅")
+                        match = indice.por_key.get(key_in)
+                        id_match = int(match[0]["id"]) if match else None
+
+                        if codigo and indice.codigo_ocupado(codigo, excepto_id=id_match):
+                            st.error(f"❌ El código {codigo} ya es de otro producto.")
+                        elif match:
+                            # el server suma la cantidad (no pisamos con un stock del cache)
+                            data = almacen.rpc("reponer_stock", {
+                                "p_producto_id": int(match[0]["id"]),
+                                "p_cantidad": int(cant),
+                                "p_precio_costo": float(costo),
+                                "p_precio_venta": float(venta),
+                                "p_categoria": cat,
+                                "p_categoria_id": int(cat_name_to_id.get(cat, 0)) if cat_name_to_id.get(cat) else None,
+                                "p_codigo": codigo or None,
+                            })
+                            fila = escribir_movimiento_stock(data)
+                            new_stock = int(fila["stock"])
+                            queue_toast(f"🔄 Stock actualizado: {new_stock - int(cant)} ➝ {new_stock}", "✅")
+                            st.rerun()
                         else:
-                            supabase.table("inventario").insert({
+                            nuevo = {
                                 "producto": nom,
                                 "marca": marca_final,
                                 "categoria": cat,
@@ -628,116 +2263,121 @@ with tab1:
                                 "stock": int(cant),
                                 "precio_costo": float(costo),
                                 "precio_venta": float(venta)
-                            }).execute()
+                            }
+                            if codigo:
+                                nuevo["codigo"] = codigo
+                            escribir("inventario", almacen.insertar("inventario", nuevo))
                             queue_toast(f"✨ Producto cargado correctamente: {nom}", "💄")
-
-                        limpiar_cache()
-                        st.rerun()
+                            st.rerun()
                     except Exception as e:
                         st.error(f"Error: {e}")
 
     # Editar
-    with sub_edit:
+    if sub == "✏️ Editar":
         if df_inv.empty:
             st.info("Cargá productos primero.")
         else:
-            sel = st.selectbox("Producto a editar", df_inv["display"].tolist())
-            row = df_inv[df_inv["display"] == sel].iloc[0]
+            row = selector_producto(indice, "Producto a editar", "edit_sel_prod")
 
-            with st.form("form_edit"):
-                a, b = st.columns(2)
-                new_nom = a.text_input("Nombre", value=row["producto"]).strip()
-                new_marca = b.text_input("Marca", value=row["marca"]).strip()
+            if row is not None:
+                with st.form("form_edit"):
+                    a, b = st.columns(2)
+                    new_nom = a.text_input("Nombre", value=row["producto"]).strip()
+                    new_marca = b.text_input("Marca", value=row["marca"]).strip()
 
-                cats = categorias_list
-                idx = cats.index(row["categoria"]) if row["categoria"] in cats else 0
-                new_cat = a.selectbox("Categoría", cats, index=idx)
+                    cats = categorias_list
+                    idx = cats.index(row["categoria"]) if row["categoria"] in cats else 0
+                    new_cat = a.selectbox("Categoría", cats, index=idx)
 
-                stock_actual = int(row.get("stock") or 0)
-                new_stock = b.number_input("Stock", min_value=0, value=stock_actual, step=1)
+                    stock_actual = int(row.get("stock") or 0)
+                    new_stock = b.number_input("Stock", min_value=0, value=stock_actual, step=1)
 
-                new_costo = a.number_input("Costo ($)", min_value=0.0, value=float(row["precio_costo"]))
-                new_venta = b.number_input("Venta ($)", min_value=0.0, value=float(row["precio_venta"]))
+                    new_costo = a.number_input("Costo ($)", min_value=0.0, value=float(row["precio_costo"]))
+                    new_venta = b.number_input("Venta ($)", min_value=0.0, value=float(row["precio_venta"]))
+                    new_codigo = normalizar_codigo(a.text_input("Código de barras / SKU", value=row.get("codigo", "")))
 
-                if st.form_submit_button("Guardar cambios"):
-                    try:
-                        id_actual = int(row["id"])
-                        new_key = new_nom.lower() + "_" + new_marca.lower()
-                        dup = df_inv[(df_inv["key"] == new_key) & (df_inv["id"] != id_actual)]
-                        if not dup.empty:
-                            st.error("❌ Ya existe otro producto con ese Nombre+Marca.")
-                        else:
-                            supabase.table("inventario").update({
-                                "producto": new_nom,
-                                "marca": new_marca,
-                                "categoria": new_cat,
-                                "categoria_id": int(cat_name_to_id.get(new_cat, 0)) if cat_name_to_id.get(new_cat) else None,
-                                "precio_costo": float(new_costo),
-                                "precio_venta": float(new_venta)
-                                ,"stock": int(new_stock)
-                            }).eq("id", id_actual).execute()
-
-                            queue_toast("💾 Cambios guardados.", "✏️")
-                            limpiar_cache()
-                            st.rerun()
-                    except Exception as e:
-                        st.error(f"Error: {e}")
+                    if st.form_submit_button("Guardar cambios"):
+                        try:
+                            id_actual = int(row["id"])
+                            new_key = new_nom.lower() + "_" + new_marca.lower()
+                            if indice.duplicado(new_key, excepto_id=id_actual):
+                                st.error("❌ Ya existe otro producto con ese Nombre+Marca.")
+                            elif new_codigo and indice.codigo_ocupado(new_codigo, excepto_id=id_actual):
+                                st.error(f"❌ El código {new_codigo} ya es de otro producto.")
+                            else:
+                                cambios = {
+                                    "producto": new_nom,
+                                    "marca": new_marca,
+                                    "categoria": new_cat,
+                                    "categoria_id": int(cat_name_to_id.get(new_cat, 0)) if cat_name_to_id.get(new_cat) else None,
+                                    "precio_costo": float(new_costo),
+                                    "precio_venta": float(new_venta)
+                                    ,"stock": int(new_stock)
+                                }
+                                # solo si cambió: sin la migración la columna no existe
+                                if new_codigo != row.get("codigo", ""):
+                                    cambios["codigo"] = new_codigo or None
+                                escribir("inventario", actualizar_si_no_cambio("inventario", row, cambios))
+
+                                queue_toast("💾 Cambios guardados.", "✏️")
+                                st.rerun()
+                        except ConflictoEdicion:
+                            reconciliar("inventario")
+                            st.error("⚠️ Otra sesión modificó este producto mientras lo editabas (¿una venta?). "
+                                     "Ya traemos los datos nuevos: revisalos y volvé a guardar.")
+                        except Exception as e:
+                            st.error(f"Error: {e}")
 
     # Ajuste
-    with sub_ajuste:
+    if sub == "📉 Ajuste":
         if df_inv.empty:
             st.info("Sin productos.")
         else:
+            # el buscador va fuera del form: dentro no se actualizaría al tipear
+            row = selector_producto(indice, "Producto", "adj_sel_prod")
+
             with st.form("form_adj"):
-                prod = st.selectbox("Producto", df_inv["display"].unique())
                 tipo = st.radio("Tipo", ["Resta (Pérdida/Regalo)", "Suma (Encontré stock)"])
                 cant = st.number_input("Cantidad", min_value=1, value=1, step=1)
                 motivo = st.text_input("Motivo (obligatorio)", placeholder="Ej: roto / regalo").strip()
 
-                if st.form_submit_button("Aplicar ajuste"):
+                if st.form_submit_button("Aplicar ajuste", disabled=row is None):
                     if not motivo:
                         st.error("⚠️ Motivo obligatorio.")
                     else:
-                        try:
-                            row = df_inv[df_inv["display"] == prod].iloc[0]
-                            id_prod = int(row["id"])
-                            stock_act = int(row["stock"])
-                            new_stock = stock_act - int(cant) if "Resta" in tipo else stock_act + int(cant)
-
-                            if new_stock < 0:
-                                st.error(f"❌ No podés dejar stock negativo. Tenés {stock_act}.")
-                            else:
-                                supabase.table("inventario").update({"stock": new_stock}).eq("id", id_prod).execute()
-
-                                signo = "-" if "Resta" in tipo else "+"
-                                supabase.table("finanzas").insert({
-                                    "fecha": now_ar_str(),
-                                    "tipo": "Ajuste",
-                                    "descripcion": f"Ajuste: {signo}{cant}x {row['producto']} ({row['marca']}) | Motivo: {motivo}",
-                                    "monto": 0.0
-                                }).execute()
-
+                        delta = -int(cant) if "Resta" in tipo else int(cant)
+                        nuevo_stock = int(row["stock"]) + delta
+                        if nuevo_stock < 0:
+                            st.error("❌ No podés dejar stock negativo.")
+                        else:
+                            try:
+                                # va al diario local; el server aplica delta + ledger en una
+                                # sola transacción (ajustar_stock) cuando se envía
+                                diario().agregar("ajuste", {
+                                    "p_producto_id": int(row["id"]),
+                                    "p_delta": delta,
+                                    "p_motivo": motivo,
+                                }, resumen=f"Ajuste {delta:+d} {row['display']} ({motivo})")
+                                tablas()["inventario"].parchar({int(row["id"]): {"stock": nuevo_stock}})
                                 st.toast("📉 Ajuste registrado.", icon="✅")
-                                limpiar_cache()
                                 st.rerun()
-                        except Exception as e:
-                            st.error(f"Error: {e}")
+                            except Exception as e:
+                                st.error(f"Error: {e}")
 
     # Eliminar
-    with sub_del:
+    if sub == "🗑️ Eliminar":
         if df_inv.empty:
             st.info("Sin productos.")
         else:
             st.warning("⚠️ Borra el producto del inventario (no borra ventas pasadas).")
-            prod = st.selectbox("Producto a eliminar", df_inv["display"].tolist())
+            row = selector_producto(indice, "Producto a eliminar", "del_sel_prod")
             ok = st.checkbox("Estoy seguro de eliminar este producto", key="chk_del_prod")
 
-            if st.button("Eliminar definitivamente", type="primary", disabled=not ok):
+            if st.button("Eliminar definitivamente", type="primary", disabled=not ok or row is None):
                 try:
-                    row = df_inv[df_inv["display"] == prod].iloc[0]
-                    supabase.table("inventario").delete().eq("id", int(row["id"])).execute()
+                    almacen.borrar("inventario", id=int(row["id"]))
+                    quitar("inventario", [int(row["id"])])
                     st.toast("🗑️ Producto eliminado.", icon="✅")
-                    limpiar_cache()
                     st.rerun()
                 except Exception as e:
                     st.error(f"Error: {e}")
@@ -745,175 +2385,196 @@ with tab1:
 # =========================================================
 # TAB 2: VENTA (FIX total sugerido + callback)
 # =========================================================
-with tab2:
+if seccion == "💰 Nueva Venta":
     st.header("💰 Registrar Venta (Carrito)")
 
-    # ===== CARRITO DE VENTAS (v3.6.1) =====
-    if "carrito" not in st.session_state:
-        st.session_state["carrito"] = []
+    # Fragmento: cantidades, subtotal y quitar/agregar re-ejecutan solo el carrito.
+    # Cobrar sí re-ejecuta la app entera (cambian stock y finanzas).
+    @st.fragment
+    def armador_carrito():
+        indice = indice_productos()
+        df_inv = indice.df
 
-    carrito = st.session_state["carrito"]
+        # ===== CARRITO DE VENTAS (v3.6.1) =====
+        # dict producto_id -> ítem: sumar/consultar/quitar es O(1)
+        if not isinstance(st.session_state.get("carrito"), dict):
+            st.session_state["carrito"] = {}
 
-    if df_inv.empty:
-        st.warning("Primero cargá productos en Inventario.")
-    else:
-        # --------- Agregar al carrito ---------
-        st.subheader("➕ Agregar productos")
+        carrito = st.session_state["carrito"]
+
+        if df_inv.empty:
+            st.warning("Primero cargá productos en Inventario.")
+        else:
+            # --------- Agregar al carrito ---------
+            st.subheader("➕ Agregar productos")
+
+            modo_caja = st.toggle("⚡ Modo caja (escáner / código)", key="cart_modo_caja")
+            if modo_caja:
+                k1, k2 = st.columns([3, 1], vertical_alignment="bottom")
+                k1.text_input(
+                    "Código",
+                    key="cart_codigo",
+                    on_change=escanear_codigo,
+                    placeholder="Escaneá o escribí el código (3*código suma 3)",
+                )
+                k2.metric("Total", formatear_monto_ars(sum(float(i.get("subtotal", 0.0)) for i in carrito.values())))
+                msg = st.session_state.pop("cart_caja_msg", None)
+                if msg:
+                    {"success": st.success, "warning": st.warning}.get(msg[0], st.error)(msg[1])
+                if not indice.por_codigo:
+                    st.caption("Ningún producto tiene código todavía: cargalo en Inventario → Editar.")
+                row = None
+            else:
+                row = selector_producto(indice, "Producto", "cart_sel_prod")
+
+            if row is not None:
+                id_prod = int(row["id"])
+                # lo que ya está en el carrito queda reservado contra el stock cacheado
+                stock_disp = disponible(row)
+                precio_unit = float(row["precio_venta"])
+
+                c1, c2, c3 = st.columns(3)
+                c1.metric("Precio Unitario", formatear_monto_ars(precio_unit))
+                c2.metric("Disponible", f"{max(0, stock_disp)} u.", help=f"Stock {int(row['stock'])} menos lo reservado en el carrito")
+                c3.metric("En carrito", str(int(carrito.get(id_prod, {}).get("cantidad", 0))))
+
+                if int(row["stock"]) <= 0:
+                    st.error("❌ Producto agotado.")
+                elif stock_disp <= 0:
+                    st.warning("Todo el stock de este producto ya está en el carrito.")
+                else:
+                    a, b = st.columns(2)
+                    cant = a.number_input(
+                        "Cantidad",
+                        min_value=1,
+                        max_value=max(1, stock_disp),
+                        value=1,
+                        step=1,
+                        key=f"cart_cant_{id_prod}",
+                    )
 
-        opciones = df_inv["display"].unique()
-        sel = st.selectbox("Producto", opciones, key="cart_sel_prod")
+                    subtotal_calc = float(precio_unit) * int(cant)
+                    b.metric("Subtotal sugerido", formatear_monto_ars(subtotal_calc))
+
+                    editar_subtotal = st.checkbox("Editar subtotal (descuento/recargo)", value=False, key=f"cart_edit_sub_{id_prod}")
+                    if editar_subtotal:
+                        subtotal = st.number_input(
+                            "Subtotal final ($)",
+                            min_value=0.0,
+                            value=float(subtotal_calc),
+                            step=100.0,
+                            key=f"cart_subtotal_{id_prod}",
+                        )
+                    else:
+                        subtotal = float(subtotal_calc)
+
+                    add_col1, add_col2 = st.columns([2, 1])
+                    if add_col1.button("➕ Agregar al carrito", type="primary", use_container_width=True):
+                        sumar_al_carrito(row, int(cant), float(subtotal))
+                        st.toast("🛒 Agregado al carrito.", icon="✅")
+                        rerun_fragmento()
 
-        if sel:
-            row = df_inv[df_inv["display"] == sel].iloc[0]
-            id_prod = int(row["id"])
-            stock_est = int(row["stock"])
-            precio_unit = float(row["precio_venta"])
+                    if add_col2.button("🗑️ Vaciar", use_container_width=True, disabled=(len(carrito) == 0)):
+                        st.session_state["carrito"] = {}
+                        st.toast("Carrito vaciado.", icon="🗑️")
+                        rerun_fragmento()
 
-            c1, c2, c3 = st.columns(3)
-            c1.metric("Precio Unitario", formatear_monto_ars(precio_unit))
-            c2.metric("Stock (estimado)", f"{stock_est} u.")
-            c3.metric("En carrito", str(sum(int(i["cantidad"]) for i in carrito if int(i["producto_id"]) == id_prod)))
+            st.divider()
 
-            if stock_est <= 0:
-                st.error("❌ Producto agotado.")
+            # --------- Mostrar carrito ---------
+            st.subheader("🛒 Carrito")
+
+            if not carrito:
+                st.info("Carrito vacío. Agregá productos arriba.")
             else:
-                a, b = st.columns(2)
-                cant = a.number_input(
-                    "Cantidad",
-                    min_value=1,
-                    max_value=max(1, stock_est),
-                    value=1,
-                    step=1,
-                    key=f"cart_cant_{id_prod}",
-                )
+                df_cart = pd.DataFrame(list(carrito.values()))
+                df_cart["Precio"] = formatear_montos_ars(df_cart["precio_unit"])
+                df_cart["Subtotal"] = formatear_montos_ars(df_cart["subtotal"])
+                df_cart_show = df_cart[["display", "cantidad", "Precio", "Subtotal"]].copy()
+                df_cart_show.columns = ["Producto", "Cantidad", "Precio Unit.", "Subtotal"]
+
+                st.dataframe(df_cart_show, use_container_width=True, hide_index=True)
+
+                total_sugerido = float(sum(float(i.get("subtotal", 0.0)) for i in carrito.values()))
 
-                subtotal_calc = float(precio_unit) * int(cant)
-                b.metric("Subtotal sugerido", formatear_monto_ars(subtotal_calc))
+                c1, c2 = st.columns([2, 1])
+                c1.metric("Total sugerido", formatear_monto_ars(total_sugerido))
 
-                editar_subtotal = st.checkbox("Editar subtotal (descuento/recargo)", value=False, key=f"cart_edit_sub_{id_prod}")
-                if editar_subtotal:
-                    subtotal = st.number_input(
-                        "Subtotal final ($)",
+                editar_total = st.checkbox("Editar total final", value=False, key="cart_edit_total")
+                if editar_total:
+                    total_final = st.number_input(
+                        "Total final a cobrar ($)",
                         min_value=0.0,
-                        value=float(subtotal_calc),
+                        value=float(total_sugerido),
                         step=100.0,
-                        key=f"cart_subtotal_{id_prod}",
+                        key="cart_total_final",
                     )
                 else:
-                    subtotal = float(subtotal_calc)
-
-                add_col1, add_col2 = st.columns([2, 1])
-                if add_col1.button("➕ Agregar al carrito", type="primary", use_container_width=True):
-                    # si ya está, sumamos cantidad y subtotal
-                    found = False
-                    for it in carrito:
-                        if int(it["producto_id"]) == id_prod:
-                            it["cantidad"] = int(it["cantidad"]) + int(cant)
-                            it["subtotal"] = float(it.get("subtotal", 0.0)) + float(subtotal)
-                            it["precio_unit"] = float(precio_unit)  # por las dudas
-                            it["display"] = sel
-                            found = True
-                            break
-                    if not found:
-                        carrito.append({
-                            "producto_id": id_prod,
-                            "display": sel,
-                            "cantidad": int(cant),
-                            "precio_unit": float(precio_unit),
-                            "subtotal": float(subtotal),
-                        })
-                    st.session_state["carrito"] = carrito
-                    st.toast("🛒 Agregado al carrito.", icon="✅")
-                    st.rerun()
+                    total_final = float(total_sugerido)
 
-                if add_col2.button("🗑️ Vaciar", use_container_width=True, disabled=(len(carrito) == 0)):
-                    st.session_state["carrito"] = []
-                    st.toast("Carrito vaciado.", icon="🗑️")
-                    st.rerun()
-
-        st.divider()
+                st.divider()
 
-        # --------- Mostrar carrito ---------
-        st.subheader("🛒 Carrito")
+                p1, p2 = st.columns(2)
+                metodo_pago = p1.selectbox("Método de pago", ["Efectivo", "Transferencia", "Cuenta Corriente", "Otro"], key="cart_metodo")
+                nota = p2.text_input("Cliente / Nota (opcional)", placeholder="Ej: María", key="cart_nota").strip()
 
-        if not carrito:
-            st.info("Carrito vacío. Agregá productos arriba.")
-        else:
-            df_cart = pd.DataFrame(carrito)
-            df_cart["Precio"] = df_cart["precio_unit"].apply(formatear_monto_ars)
-            df_cart["Subtotal"] = df_cart["subtotal"].apply(formatear_monto_ars)
-            df_cart_show = df_cart[["display", "cantidad", "Precio", "Subtotal"]].copy()
-            df_cart_show.columns = ["Producto", "Cantidad", "Precio Unit.", "Subtotal"]
-
-            st.dataframe(df_cart_show, use_container_width=True, hide_index=True)
-
-            total_sugerido = float(sum(float(i.get("subtotal", 0.0)) for i in carrito))
-
-            c1, c2 = st.columns([2, 1])
-            c1.metric("Total sugerido", formatear_monto_ars(total_sugerido))
-
-            editar_total = st.checkbox("Editar total final", value=False, key="cart_edit_total")
-            if editar_total:
-                total_final = st.number_input(
-                    "Total final a cobrar ($)",
-                    min_value=0.0,
-                    value=float(total_sugerido),
-                    step=100.0,
-                    key="cart_total_final",
+                # Quitar item
+                rm1, rm2 = st.columns([3, 1])
+                sel_rm = rm1.selectbox(
+                    "Quitar ítem",
+                    list(carrito),
+                    format_func=lambda pid: f'{carrito[pid]["display"]} (x{carrito[pid]["cantidad"]})',
+                    key="cart_rm_sel",
                 )
-            else:
-                total_final = float(total_sugerido)
+                if rm2.button("Quitar", use_container_width=True):
+                    carrito.pop(sel_rm, None)
+                    st.session_state["carrito"] = carrito
+                    rerun_fragmento()
 
-            st.divider()
+                st.divider()
 
-            p1, p2 = st.columns(2)
-            metodo_pago = p1.selectbox("Método de pago", ["Efectivo", "Transferencia", "Cuenta Corriente", "Otro"], key="cart_metodo")
-            nota = p2.text_input("Cliente / Nota (opcional)", placeholder="Ej: María", key="cart_nota").strip()
-
-            # Quitar item
-            rm1, rm2 = st.columns([3, 1])
-            opciones_rm = [f'{it["display"]} (x{it["cantidad"]})' for it in carrito]
-            sel_rm = rm1.selectbox("Quitar ítem", opciones_rm, key="cart_rm_sel")
-            if rm2.button("Quitar", use_container_width=True):
-                idx = opciones_rm.index(sel_rm)
-                carrito.pop(idx)
-                st.session_state["carrito"] = carrito
-                st.rerun()
+                # --------- Procesar venta (RPC) ---------
+                if st.button("✅ Procesar venta (carrito)", type="primary", use_container_width=True):
+                    try:
+                        # armado payload RPC
+                        items_rpc = [{"producto_id": int(i["producto_id"]), "cantidad": int(i["cantidad"])} for i in carrito.values()]
+
+                        # descripción corta y útil
+                        desc_items = " | ".join([f'{int(i["cantidad"])}x {str(i["display"])}' for i in carrito.values()])
+                        desc = f"Venta carrito: {desc_items} | Pago: {metodo_pago}"
+                        if nota:
+                            desc += f" | Nota: {nota}"
+
+                        # queda en el diario local (no espera a la red); el hilo del diario
+                        # la manda a registrar_venta_carrito y recarga al confirmarse
+                        diario().agregar(
+                            "venta",
+                            {
+                                "p_items": items_rpc,
+                                "p_monto_total": float(total_final),
+                                "p_descripcion": desc,
+                                "p_metodo_pago": metodo_pago,
+                            },
+                            resumen=desc,
+                        )
+
+                        # descontamos ya en el cache para que el stock mostrado no mienta
+                        tablas()["inventario"].parchar({
+                            pid: {"stock": int(indice.por_id[pid]["stock"]) - int(i["cantidad"])}
+                            for pid, i in carrito.items() if pid in indice.por_id
+                        })
 
-            st.divider()
+                        st.toast("💰 Venta de carrito registrada!", icon="✅")
+                        st.session_state["carrito"] = {}
+                        st.rerun()
 
-            # --------- Procesar venta (RPC) ---------
-            if st.button("✅ Procesar venta (carrito)", type="primary", use_container_width=True):
-                try:
-                    # armado payload RPC
-                    items_rpc = [{"producto_id": int(i["producto_id"]), "cantidad": int(i["cantidad"])} for i in carrito]
-
-                    # descripción corta y útil
-                    desc_items = " | ".join([f'{int(i["cantidad"])}x {str(i["display"])}' for i in carrito])
-                    desc = f"Venta carrito: {desc_items} | Pago: {metodo_pago}"
-                    if nota:
-                        desc += f" | Nota: {nota}"
-
-                    supabase.rpc(
-                        "registrar_venta_carrito",
-                        {
-                            "p_items": items_rpc,
-                            "p_monto_total": float(total_final),
-                            "p_descripcion": desc,
-                            "p_metodo_pago": metodo_pago,
-                        },
-                    ).execute()
-
-                    st.toast("💰 Venta de carrito registrada!", icon="✅")
-                    st.session_state["carrito"] = []
-                    limpiar_cache()
-                    st.rerun()
+                    except Exception as e:
+                        st.error(f"❌ Error al procesar la venta: {e}")
 
-                except Exception as e:
-                    st.error(f"❌ Error al procesar la venta: {e}")
+    armador_carrito()
 
 
-with tab3:
+if seccion == "💸 Nuevo Gasto":
     st.header("💸 Registrar Gasto")
 
     with st.form("form_gasto"):
@@ -924,15 +2585,14 @@ with tab3:
                 st.error("⚠️ Poné descripción y un monto válido.")
             else:
                 try:
-                    supabase.table("finanzas").insert({
+                    diario().agregar("finanzas", {
                         "fecha": now_ar_str(),
                         "tipo": "Gasto",
                         "descripcion": desc,
                         "monto": -float(monto)
-                    }).execute()
+                    }, resumen=f"Gasto: {desc} ({formatear_monto_ars(monto)})")
 
                     st.toast("💸 Gasto registrado.", icon="✅")
-                    limpiar_cache()
                     st.rerun()
                 except Exception as e:
                     st.error(f"Error: {e}")
@@ -940,28 +2600,26 @@ with tab3:
 # =========================================================
 # TAB 4: FINANZAS
 # =========================================================
-with tab4:
+if seccion == "📊 Finanzas":
     st.header("📊 Finanzas")
 
-    df_work = df_fin.copy() if not df_fin.empty else pd.DataFrame(
-        columns=["id", "fecha", "tipo", "descripcion", "monto", "producto_id", "cantidad", "metodo_pago"]
-    )
+    # normalizado una sola vez por versión de finanzas y compartido por
+    # el filtro, el expander de borrado y el detalle (no modificar in place)
+    df_work = ledger_normalizado()
 
     filtro_txt = "Todos los tiempos"
-    df_fil = df_work.copy()
+    df_fil = df_work
 
     if not df_work.empty:
-        df_work2 = formatear_fecha_arg(df_work)
-        df_work2["mes"] = pd.to_datetime(df_work2["fecha_dt"], errors="coerce").dt.strftime("%Y-%m")
-        meses = ["Todos los tiempos"] + sorted(df_work2["mes"].dropna().unique().tolist(), reverse=True)
+        version_fin = tablas()["finanzas"].version
+        meses = ["Todos los tiempos"] + meses_finanzas(version_fin, df_work)
 
         col_f, _ = st.columns([1, 3])
         filtro_txt = col_f.selectbox("📅 Filtrar por mes", meses)
 
         if filtro_txt != "Todos los tiempos":
-            df_fil = df_work2[df_work2["mes"] == filtro_txt].copy()
-        else:
-            df_fil = df_work2.copy()
+            # el ledger ya está en memoria: filtrar el mes no viaja al server
+            df_fil = df_work[df_work["mes"] == filtro_txt]
 
     if not df_fil.empty:
         ingresos = df_fil[df_fil["monto"] > 0]["monto"].sum()
@@ -977,83 +2635,90 @@ with tab4:
 
     st.divider()
 
-    with st.expander("🗑️ Corregir / Eliminar movimiento (restituye stock si es venta)"):
-        if df_work.empty:
-            st.info("Nada para borrar.")
-        else:
-            base = df_work.copy()
-            base["id"] = pd.to_numeric(base["id"], errors="coerce")
-            base = base.dropna(subset=["id"]).copy()
-            base["id"] = base["id"].astype(int)
-
-            base_fmt = formatear_fecha_arg(base)
-            base_fmt["monto_fmt"] = base_fmt["monto"].apply(formatear_monto_ars)
-            base_fmt = base_fmt.sort_values("id", ascending=False)
-
-            busq = st.text_input("🔍 Buscar", placeholder="Ej: labial / 1500 / efectivo").strip()
-            show = base_fmt
-            if busq:
+    # toggle en vez de expander: cerrado no calcula nada (el expander corre igual)
+    if st.toggle("🗑️ Corregir / Eliminar movimiento (restituye stock si es venta)", key="fin_corregir"):
+        busq = st.text_input("🔍 Buscar", placeholder="Ej: labial / 1500 / efectivo").strip()
+        # la búsqueda la resuelve el server (uno más del tope para saber si hay otros)
+        try:
+            show = buscar_movimientos(busq, tablas()["finanzas"].version, MAX_OPCIONES_SELECTOR + 1)
+        except Exception:
+            show = df_work
+            for termino in filter(None, (t.strip() for t in busq.split("/"))):
                 mask = (
-                    show["descripcion"].str.contains(busq, case=False, na=False)
-                    | show["tipo"].astype(str).str.contains(busq, case=False, na=False)
+                    show["descripcion"].str.contains(termino, case=False, na=False, regex=False)
+                    | show["tipo"].str.contains(termino, case=False, na=False, regex=False)
+                    | show["monto_fmt"].str.contains(termino, case=False, na=False, regex=False)
                 )
                 show = show[mask]
 
-            if show.empty:
-                st.info("No se encontró nada con ese filtro.")
-            else:
-                def label_row(r):
-                    f = r.get("fecha_fmt", str(r.get("fecha", "")))
-                    return f"{f} | {r.get('tipo','')} | {r.get('descripcion','')} | {r.get('monto_fmt','')} | (ID:{int(r['id'])})"
-
-                options = show["id"].tolist()
-                id_sel = st.selectbox(
-                    "Movimiento",
-                    options=options,
-                    format_func=lambda _id: label_row(show[show["id"] == _id].iloc[0])
-                )
+        if show.empty:
+            st.info("No se encontró nada con ese filtro." if busq else "Nada para borrar.")
+        else:
+            # solo los primeros N (más nuevos primero); el resto se encuentra buscando
+            top = show.head(MAX_OPCIONES_SELECTOR)
+            opciones = top["id"].tolist()
+            if len(show) > len(opciones):
+                st.caption(f"Mostrando los {len(opciones)} más recientes. Afiná la búsqueda para ver otros.")
+            etiquetas = dict(zip(opciones, top["etiqueta"].tolist()))
+            id_sel = st.selectbox(
+                "Movimiento",
+                options=opciones,
+                format_func=lambda _id: etiquetas.get(_id, f"(ID:{_id})"),
+            )
 
-                ok = st.checkbox("Confirmo borrar este movimiento", key="chk_del_mov")
+            ok = st.checkbox("Confirmo borrar este movimiento", key="chk_del_mov")
 
-                if st.button("Borrar (y restituir si aplica)", type="primary", disabled=not ok):
+            if st.button("Borrar (y restituir si aplica)", type="primary", disabled=not ok):
+                try:
                     try:
-                        try:
-                            supabase.rpc("borrar_movimiento_y_restituir", {"p_finanzas_id": int(id_sel)}).execute()
-                        except Exception:
-                            supabase.table("finanzas").delete().eq("id", int(id_sel)).execute()
-
-                        st.toast("🗑️ Movimiento eliminado.", icon="✅")
-                        limpiar_cache()
-                        st.rerun()
-                    except Exception as e:
-                        st.error(f"Error: {e}")
-
-    st.subheader(f"Detalle: {filtro_txt}")
-
-    if not df_fil.empty:
-        df_show = df_fil.copy()
-        if "fecha_fmt" not in df_show.columns:
-            df_show = formatear_fecha_arg(df_show)
-
-        df_show["monto_fmt"] = df_show["monto"].apply(formatear_monto_ars)
-
-        tabla = df_show.sort_values("id", ascending=False)[["fecha_fmt", "tipo", "descripcion", "monto_fmt"]].copy()
-        tabla.columns = ["Fecha", "Tipo", "Descripción", "Monto"]
+                        almacen.rpc("borrar_movimiento_y_restituir", {"p_finanzas_id": int(id_sel)})
+                    except Exception:
+                        almacen.borrar("finanzas", id=int(id_sel))
+                    quitar("finanzas", [id_sel])
+                    # la restitución de stock la hace el server: no sabemos qué filas tocó
+                    invalidar("inventario")
+
+                    st.toast("🗑️ Movimiento eliminado.", icon="✅")
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"Error: {e}")
 
-        st.dataframe(tabla, use_container_width=True, hide_index=True)
+    # Fragmento: paginar o preparar el CSV no re-ejecuta el resto de la app
+    @st.fragment
+    def detalle_finanzas(df_fil: pd.DataFrame, filtro_txt: str):
+        st.subheader(f"Detalle: {filtro_txt}")
+
+        # el ledger ya está en memoria: se pagina el frame y al browser
+        # solo viaja una página por rerun
+        total = len(df_fil)
+
+        if total > 0:
+            tam, pagina = paginador(total, f"fin_pag_{filtro_txt}")
+            # df_fil ya viene normalizado y ordenado por id DESC
+            df_show = df_fil.iloc[(pagina - 1) * tam : pagina * tam]
+
+            tabla = df_show[["fecha_fmt", "tipo", "descripcion", "monto_fmt"]].copy()
+            tabla.columns = ["Fecha", "Tipo", "Descripción", "Monto"]
+
+            st.dataframe(tabla, use_container_width=True, hide_index=True)
+            st.caption(f"Mostrando {len(tabla)} de {total} movimientos.")
+
+            # Export CSV (a pedido: no armamos el archivo entero en cada rerun)
+            if st.checkbox("Preparar exportación del período (CSV)", key="fin_csv_ok"):
+                exp = df_fil[["fecha_fmt", "tipo", "descripcion", "monto_fmt"]].copy()
+                exp.columns = ["Fecha", "Tipo", "Descripción", "Monto"]
+                st.download_button(
+                    "⬇️ Exportar finanzas (CSV)",
+                    exp.to_csv(index=False).encode("utf-8"),
+                    file_name="ilara_finanzas.csv",
+                    mime="text/csv",
+                    use_container_width=True,
+                )
 
-        # Export CSV
-        csv_fin = tabla.to_csv(index=False).encode("utf-8")
-        st.download_button(
-            "⬇️ Exportar finanzas (CSV)",
-            csv_fin,
-            file_name="ilara_finanzas.csv",
-            mime="text/csv",
-            use_container_width=True,
-        )
+        else:
+            st.info("No hay movimientos para mostrar.")
 
-    else:
-        st.info("No hay movimientos para mostrar.")
+    detalle_finanzas(df_fil, filtro_txt)
 
 # =========================================================
 
@@ -1073,12 +2738,12 @@ with tab4:
             st.error("⚠️ Poné un monto mayor a 0.")
         else:
             try:
-                supabase.table("finanzas").insert({
+                diario().agregar("finanzas", {
                     "fecha": now_ar_str(),
                     "tipo": "Ingreso",
                     "descripcion": desc_in or "Ingreso manual",
                     "monto": float(monto_in)  # ✅ positivo
-                }).execute()
+                }, resumen=f"Ingreso: {desc_in or 'Ingreso manual'} ({formatear_monto_ars(monto_in)})")
 
                 # ✅ toast que sobrevive al rerun (usa tu helper)
                 try:
@@ -1086,12 +2751,11 @@ with tab4:
                 except Exception:
                     st.toast("💰 Ingreso agregado correctamente", icon="🎁")
 
-                limpiar_cache()
                 st.rerun()
             except Exception as e:
                 st.error(f"❌ Error al agregar ingreso: {e}")
 
-with tab5:
+if seccion == "🏷️ Categorías":
     st.header("🏷️ Categorías")
 
     st.caption("Administrá las categorías desde acá. Se usan en Inventario (Agregar/Editar).")
@@ -1113,9 +2777,12 @@ with tab5:
 
     st.divider()
 
-    c_add, c_ren, c_del = st.tabs(["➕ Agregar", "✏️ Renombrar", "🗑️ Eliminar"])
+    sub_cat = st.segmented_control(
+        "Acción", SUB_CATEGORIAS, default=SUB_CATEGORIAS[0], required=True,
+        key="cat_sub", label_visibility="collapsed",
+    )
 
-    with c_add:
+    if sub_cat == "➕ Agregar":
         with st.form("form_cat_add"):
             nombre = st.text_input("Nueva categoría", placeholder="Ej: Uñas").strip()
             if st.form_submit_button("Guardar", type="primary"):
@@ -1123,14 +2790,13 @@ with tab5:
                     st.error("⚠️ Escribí un nombre.")
                 else:
                     try:
-                        supabase.table("categorias").insert({"nombre": nombre}).execute()
+                        escribir("categorias", almacen.insertar("categorias", {"nombre": nombre}))
                         st.toast("✅ Categoría agregada.", icon="✅")
-                        limpiar_cache()
                         st.rerun()
                     except Exception as e:
                         st.error(f"Error: {e}")
 
-    with c_ren:
+    if sub_cat == "✏️ Renombrar":
         df_cats_view = cargar_categorias()
         nombres = df_cats_view["nombre"].astype(str).tolist() if (not df_cats_view.empty and "nombre" in df_cats_view.columns) else []
         if not nombres:
@@ -1146,21 +2812,22 @@ with tab5:
                         try:
                             row = df_cats_view[df_cats_view["nombre"].astype(str) == old].iloc[0]
                             cat_id = int(row["id"])
-                            supabase.table("categorias").update({"nombre": new_name}).eq("id", cat_id).execute()
+                            escribir("categorias", almacen.actualizar("categorias", {"nombre": new_name}, id=cat_id))
 
                             # compat: si inventario aún guarda texto en 'categoria', lo mantenemos sincronizado
                             try:
-                                supabase.table("inventario").update({"categoria": new_name}).eq("categoria_id", cat_id).execute()
+                                filas_inv = almacen.actualizar("inventario", {"categoria": new_name}, categoria_id=cat_id)
+                                if filas_inv:
+                                    escribir("inventario", filas_inv)
                             except Exception:
-                                pass
+                                invalidar("inventario")
 
                             st.toast("✏️ Categoría renombrada.", icon="✅")
-                            limpiar_cache()
                             st.rerun()
                         except Exception as e:
                             st.error(f"Error: {e}")
 
-    with c_del:
+    if sub_cat == "🗑️ Eliminar":
         df_cats_view = cargar_categorias()
         nombres = df_cats_view["nombre"].astype(str).tolist() if (not df_cats_view.empty and "nombre" in df_cats_view.columns) else []
         if not nombres:
@@ -1175,27 +2842,31 @@ with tab5:
 
             # chequeo de uso (no borrar si está en inventario)
             try:
-                used = supabase.table("inventario").select("id").eq("categoria_id", cat_id).execute()
-                used_count = len(used.data or [])
+                # solo el conteo, sin bajar filas
+                used_count = almacen.contar("inventario", categoria_id=cat_id)
             except Exception:
-                used_count = 0
+                used_count = None
 
-            if used_count > 0:
+            if used_count is None:
+                # sin poder contar no borramos: podría estar en uso
+                st.error("❌ No pudimos verificar si la categoría está en uso (¿sin conexión?). Probá de nuevo.")
+                st.button("Eliminar", disabled=True, use_container_width=True)
+            elif used_count > 0:
                 st.warning(f"⚠️ No se puede borrar: está en uso por {used_count} producto(s). Renombrala o reasigná esos productos.")
                 st.button("Eliminar", disabled=True, use_container_width=True)
             else:
                 if st.button("Eliminar", type="primary", disabled=not ok, use_container_width=True):
                     try:
-                        supabase.table("categorias").delete().eq("id", cat_id).execute()
+                        almacen.borrar("categorias", id=cat_id)
+                        quitar("categorias", [cat_id])
                         st.toast("🗑️ Categoría eliminada.", icon="✅")
-                        limpiar_cache()
                         st.rerun()
                     except Exception as e:
                         st.error(f"Error: {e}")
 
 # TAB 6: ABOUT
 # =========================================================
-with tab6:
+if seccion == "💌 About":
     st.header("💌 About")
     st.write("Esta app está hecha para ordenar stock, ventas y gastos de **Ilara Beauty**.")
     st.divider()
@@ -1210,6 +2881,13 @@ Que cada venta te acerque a lo que soñás, y que nunca te falten motivos para s
 — Ilan
 """)
 
+    with st.expander("🔧 Diagnóstico de carga"):
+        tiempos = st.session_state.get("_tiempos_carga", {})
+        st.caption(f"Última carga: {tiempos.get('total_ms', 0):.0f} ms en total · {edad_datos_txt()} · datos en {almacen.nombre}")
+        for nombre in ["inventario", "finanzas", "categorias"]:
+            ms = tiempos.get(nombre)
+            st.caption(f"• {nombre}: " + (f"última bajada {ms:.0f} ms" if ms is not None else "sin bajadas todavía"))
+
 
 
 
@@ -0,0 +1,19 @@
+-- =========================================================
+-- Búsqueda de movimientos en el server (ilike '%...%')
+-- Índices trigram para que el buscador no recorra toda la tabla.
+-- Correr una vez en el SQL Editor de Supabase.
+-- =========================================================
+
+create extension if not exists pg_trgm;
+
+create index if not exists finanzas_descripcion_trgm_idx
+  on finanzas using gin (descripcion gin_trgm_ops);
+
+create index if not exists finanzas_tipo_trgm_idx
+  on finanzas using gin (tipo gin_trgm_ops);
+
+create index if not exists finanzas_metodo_pago_trgm_idx
+  on finanzas using gin (metodo_pago gin_trgm_ops);
+
+create index if not exists finanzas_monto_idx
+  on finanzas (monto);
@@ -0,0 +1,11 @@
+-- =========================================================
+-- inventario.codigo: código de barras / SKU para el modo caja
+-- Correr una vez en el SQL Editor de Supabase.
+-- =========================================================
+
+alter table inventario add column if not exists codigo text;
+
+-- un código identifica a un solo producto (los vacíos no cuentan)
+create unique index if not exists inventario_codigo_uidx
+  on inventario (upper(btrim(codigo)))
+  where codigo is not null and btrim(codigo) <> '';
@@ -0,0 +1,99 @@
+-- =========================================================
+-- Ajuste y reposición de stock en un solo viaje (mismo estilo que
+-- registrar_venta_carrito): el delta se aplica en el server de forma
+-- atómica junto con su fila en finanzas, nunca a partir de un stock
+-- absoluto leído de un cache.
+-- Devuelven {"inventario": fila, "finanzas": fila} para el write-through.
+-- Correr una vez en el SQL Editor de Supabase.
+-- =========================================================
+
+create or replace function ajustar_stock(
+  p_producto_id bigint,
+  p_delta integer,
+  p_motivo text
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+  v_inv inventario%rowtype;
+  v_fin finanzas%rowtype;
+begin
+  if p_delta = 0 then
+    raise exception 'delta inválido';
+  end if;
+
+  update inventario
+     set stock = coalesce(stock, 0) + p_delta
+   where id = p_producto_id
+     and coalesce(stock, 0) + p_delta >= 0
+  returning * into v_inv;
+
+  if not found then
+    if exists (select 1 from inventario where id = p_producto_id) then
+      raise exception 'stock insuficiente';
+    end if;
+    raise exception 'producto inexistente';
+  end if;
+
+  insert into finanzas (fecha, tipo, descripcion, monto)
+  values (
+    to_char(now() at time zone 'America/Argentina/Buenos_Aires', 'DD/MM/YYYY HH24:MI'),
+    'Ajuste',
+    format('Ajuste: %s%sx %s (%s) | Motivo: %s',
+           case when p_delta < 0 then '-' else '+' end, abs(p_delta),
+           v_inv.producto, v_inv.marca, p_motivo),
+    0
+  )
+  returning * into v_fin;
+
+  return jsonb_build_object('inventario', to_jsonb(v_inv), 'finanzas', to_jsonb(v_fin));
+end;
+$$;
+
+create or replace function reponer_stock(
+  p_producto_id bigint,
+  p_cantidad integer,
+  p_precio_costo numeric,
+  p_precio_venta numeric,
+  p_categoria text,
+  p_categoria_id bigint,
+  p_codigo text default null
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+  v_inv inventario%rowtype;
+  v_fin finanzas%rowtype;
+begin
+  if p_cantidad <= 0 then
+    raise exception 'cantidad inválida';
+  end if;
+
+  update inventario
+     set stock = coalesce(stock, 0) + p_cantidad,
+         precio_costo = p_precio_costo,
+         precio_venta = p_precio_venta,
+         categoria = p_categoria,
+         categoria_id = p_categoria_id,
+         codigo = coalesce(nullif(btrim(p_codigo), ''), codigo)
+   where id = p_producto_id
+  returning * into v_inv;
+
+  if not found then
+    raise exception 'producto inexistente';
+  end if;
+
+  insert into finanzas (fecha, tipo, descripcion, monto)
+  values (
+    to_char(now() at time zone 'America/Argentina/Buenos_Aires', 'DD/MM/YYYY HH24:MI'),
+    'Reposición',
+    format('Reposición: +%sx %s (%s)', p_cantidad, v_inv.producto, v_inv.marca),
+    0
+  )
+  returning * into v_fin;
+
+  return jsonb_build_object('inventario', to_jsonb(v_inv), 'finanzas', to_jsonb(v_fin));
+end;
+$$;
@@ -0,0 +1,24 @@
+-- =========================================================
+-- inventario.version: control de concurrencia optimista (CAS)
+-- Cada UPDATE (de la app o de las RPCs) incrementa la versión; la app
+-- edita con `... where id = ? and version = ?` y si no matchea ninguna
+-- fila sabe que otra sesión escribió primero.
+-- Correr una vez en el SQL Editor de Supabase.
+-- =========================================================
+
+alter table inventario add column if not exists version integer not null default 1;
+
+create or replace function inventario_bump_version()
+returns trigger
+language plpgsql
+as $$
+begin
+  new.version := coalesce(old.version, 0) + 1;
+  return new;
+end;
+$$;
+
+drop trigger if exists trg_inventario_version on inventario;
+create trigger trg_inventario_version
+before update on inventario
+for each row execute function inventario_bump_version();
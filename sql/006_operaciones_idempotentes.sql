@@ -0,0 +1,155 @@
+-- =========================================================
+-- Escrituras idempotentes para el diario local de la app
+-- La app anota cada venta / gasto / ingreso / ajuste en un diario SQLite
+-- con una clave única y un proceso en segundo plano las reenvía acá.
+-- Si la conexión se corta después de aplicar pero antes de la respuesta,
+-- el reintento con la misma clave devuelve el resultado guardado en vez
+-- de registrar la operación dos veces.
+-- Las ventas y ajustes llevan p_fecha (la hora en que se anotaron en el
+-- diario): si salen horas después, el movimiento queda con su fecha real.
+-- Correr una vez en el SQL Editor de Supabase (después de 004).
+-- =========================================================
+
+create table if not exists operaciones_aplicadas (
+  clave text primary key,
+  op text not null,
+  resultado jsonb,
+  aplicada_en timestamptz not null default now()
+);
+
+-- ajustar_stock de 004 + p_fecha (sin p_fecha: la hora del server, como antes)
+drop function if exists ajustar_stock(bigint, integer, text);
+
+create or replace function ajustar_stock(
+  p_producto_id bigint,
+  p_delta integer,
+  p_motivo text,
+  p_fecha text default null
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+  v_inv inventario%rowtype;
+  v_fin finanzas%rowtype;
+begin
+  if p_delta = 0 then
+    raise exception 'delta inválido';
+  end if;
+
+  update inventario
+     set stock = coalesce(stock, 0) + p_delta
+   where id = p_producto_id
+     and coalesce(stock, 0) + p_delta >= 0
+  returning * into v_inv;
+
+  if not found then
+    if exists (select 1 from inventario where id = p_producto_id) then
+      raise exception 'stock insuficiente';
+    end if;
+    raise exception 'producto inexistente';
+  end if;
+
+  insert into finanzas (fecha, tipo, descripcion, monto)
+  values (
+    coalesce(p_fecha, to_char(now() at time zone 'America/Argentina/Buenos_Aires', 'DD/MM/YYYY HH24:MI')),
+    'Ajuste',
+    format('Ajuste: %s%sx %s (%s) | Motivo: %s',
+           case when p_delta < 0 then '-' else '+' end, abs(p_delta),
+           v_inv.producto, v_inv.marca, p_motivo),
+    0
+  )
+  returning * into v_fin;
+
+  return jsonb_build_object('inventario', to_jsonb(v_inv), 'finanzas', to_jsonb(v_fin));
+end;
+$$;
+
+-- registrar_venta_carrito + p_fecha: corre la original y le pone la fecha
+-- a la fila de finanzas que insertó (la de esta transacción: xmin propio)
+create or replace function registrar_venta_carrito(
+  p_items jsonb,
+  p_monto_total numeric,
+  p_descripcion text,
+  p_metodo_pago text,
+  p_fecha text
+)
+returns void
+language plpgsql
+as $$
+declare
+  v_desde bigint;
+begin
+  select coalesce(max(id), 0) into v_desde from finanzas;
+
+  perform registrar_venta_carrito(
+    p_items => p_items,
+    p_monto_total => p_monto_total,
+    p_descripcion => p_descripcion,
+    p_metodo_pago => p_metodo_pago
+  );
+
+  if p_fecha is not null then
+    update finanzas
+       set fecha = p_fecha
+     where id > v_desde
+       and xmin = pg_current_xact_id()::xid
+       and tipo = 'Venta';
+  end if;
+end;
+$$;
+
+create or replace function ejecutar_idempotente(
+  p_clave text,
+  p_op text,
+  p_args jsonb
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+  v_previo jsonb;
+  v_res jsonb;
+  v_fin finanzas%rowtype;
+begin
+  -- serializa reintentos concurrentes de la misma clave
+  perform pg_advisory_xact_lock(hashtext(p_clave));
+
+  select resultado into v_previo from operaciones_aplicadas where clave = p_clave;
+  if found then
+    return v_previo;
+  end if;
+
+  if p_op = 'venta' then
+    perform registrar_venta_carrito(
+      p_items => p_args->'p_items',
+      p_monto_total => (p_args->>'p_monto_total')::numeric,
+      p_descripcion => p_args->>'p_descripcion',
+      p_metodo_pago => p_args->>'p_metodo_pago',
+      p_fecha => p_args->>'p_fecha'
+    );
+    v_res := null;
+
+  elsif p_op = 'finanzas' then
+    insert into finanzas (fecha, tipo, descripcion, monto)
+    values (p_args->>'fecha', p_args->>'tipo', p_args->>'descripcion', (p_args->>'monto')::numeric)
+    returning * into v_fin;
+    v_res := to_jsonb(v_fin);
+
+  elsif p_op = 'ajuste' then
+    v_res := ajustar_stock(
+      (p_args->>'p_producto_id')::bigint,
+      (p_args->>'p_delta')::integer,
+      p_args->>'p_motivo',
+      p_args->>'p_fecha'
+    );
+
+  else
+    raise exception 'operación desconocida: %', p_op;
+  end if;
+
+  -- misma transacción: si la operación falla, la clave no queda registrada
+  insert into operaciones_aplicadas (clave, op, resultado) values (p_clave, p_op, v_res);
+  return v_res;
+end;
+$$;
@@ -0,0 +1,289 @@
+"""
+Tests de las funciones puras de app.py.
+app.py es un script de Streamlit (arma la UI al importarlo): acá se ejecutan
+solo los imports y las definiciones pedidas, sin levantar la app.
+"""
+import ast
+from pathlib import Path
+
+APP = Path(__file__).resolve().parents[1] / "app.py"
+
+
+def cargar(*nombres: str) -> dict:
+    arbol = ast.parse(APP.read_text(encoding="utf-8"))
+    nodos = []
+    for nodo in arbol.body:
+        if isinstance(nodo, (ast.Import, ast.ImportFrom)):
+            nodos.append(nodo)
+        elif isinstance(nodo, (ast.FunctionDef, ast.ClassDef)) and nodo.name in nombres:
+            nodo.decorator_list = []  # sin st.cache_*: cada test ve la función pelada
+            nodos.append(nodo)
+        elif isinstance(nodo, ast.Assign) and any(getattr(t, "id", None) in nombres for t in nodo.targets):
+            nodos.append(nodo)
+    ns = {}
+    exec(compile(ast.Module(body=nodos, type_ignores=[]), str(APP), "exec"), ns)
+    return ns
+
+
+# ---------------------------------------------------------
+# búsqueda de movimientos
+# ---------------------------------------------------------
+BUSQUEDA = cargar("parsear_monto", "terminos_busqueda", "filtros_busqueda")
+
+
+def test_monto_con_coma_decimal():
+    assert BUSQUEDA["terminos_busqueda"]("1500,50") == [("1500 50", 1500.5)]
+    assert BUSQUEDA["terminos_busqueda"]("1.234.567,50")[0][1] == 1234567.5
+
+
+def test_montos_de_7_o_mas_digitos_exactos():
+    filtros = BUSQUEDA["filtros_busqueda"]
+    assert filtros("1234567,89")[0].startswith("monto.eq.1234567.89,monto.eq.-1234567.89,")
+    assert filtros("150000,5")[0].startswith("monto.eq.150000.5,")
+    assert filtros("12.345.678")[0].startswith("monto.eq.12345678.0,")
+
+
+def test_texto_y_monto_se_combinan():
+    filtros = BUSQUEDA["filtros_busqueda"]("labial / 1.500")
+    assert filtros[0] == 'descripcion.ilike."*labial*",tipo.ilike."*labial*",metodo_pago.ilike."*labial*"'
+    assert filtros[1].startswith("monto.eq.1500.0,monto.eq.-1500.0,")
+    assert BUSQUEDA["filtros_busqueda"](" / ( ) / ") == []
+
+
+def test_sqlite_busca_igual_que_postgrest(tmp_path):
+    ns = cargar(
+        "Repositorio", "RepoSQLite", "now_ar_str", "DEFAULT_CATEGORIAS",
+        "parsear_monto", "terminos_busqueda",
+    )
+    repo = ns["RepoSQLite"](str(tmp_path / "ilara.sqlite3"))
+    for desc, monto in [("venta labial", 1500.5), ("compra", -1234567.89), ("otra", 150000.0)]:
+        repo.insertar("finanzas", {"fecha": "01/03/2025 10:00", "tipo": "Venta", "descripcion": desc, "monto": monto})
+
+    def buscar(busq):
+        return [r["descripcion"] for r in repo.buscar_finanzas(busq, "descripcion", 10)]
+
+    assert buscar("1500,50") == ["venta labial"]
+    assert buscar("1.234.567,89") == ["compra"]
+    assert buscar("labial / 1500,5") == ["venta labial"]
+    assert buscar("150000,5") == []
+
+
+# ---------------------------------------------------------
+# TablaCache: la versión solo sube si cambian los datos
+# ---------------------------------------------------------
+CACHE = cargar("TablaCache", "LedgerFinanzas", "upsert_por_id", "columnas", "COLUMNAS", "CACHE_TTL", "FIN_RECONCILIAR_SEG")
+
+
+def test_sincronizar_sin_cambios_no_sube_version():
+    filas = [{"id": 1, "nombre": "Labios"}, {"id": 2, "nombre": "Ojos"}]
+
+    class Tabla(CACHE["TablaCache"]):
+        def _bajar(self):
+            return CACHE["pd"].DataFrame(filas)
+
+    t = Tabla("categorias", orden="nombre")
+    t.sincronizar(forzar=True)
+    assert t.version == 1
+    t.sincronizar(forzar=True)
+    assert t.version == 1
+    filas.append({"id": 3, "nombre": "Rostro"})
+    t.sincronizar(forzar=True)
+    assert t.version == 2
+
+
+def test_ledger_delta_vacio_no_sube_version():
+    lotes = [([{"id": 1, "monto": 10.0}], None), ([], None), ([], {1})]
+
+    class Ledger(CACHE["LedgerFinanzas"]):
+        def _bajar(self):
+            return lotes.pop(0)
+
+    t = Ledger()
+    t.sincronizar(forzar=True)
+    t.sincronizar(forzar=True)
+    t.sincronizar(forzar=True)
+    assert t.version == 1
+
+
+def test_ledger_sin_migracion_baja_lo_que_haya():
+    ns = cargar(
+        "TablaCache", "LedgerFinanzas", "upsert_por_id", "columnas", "COLUMNAS", "CACHE_TTL",
+        "FIN_RECONCILIAR_SEG", "falta_columna",
+    )
+
+    class ColumnaInexistente(Exception):
+        code = "42703"
+
+    class Almacen:
+        def bajar(self, tabla, columnas="*", desde_id=0):
+            if columnas != "*":
+                raise ColumnaInexistente("column finanzas.tipo does not exist")
+            return [{"id": 1, "fecha": "01/03/2025 10:00", "descripcion": "vieja", "monto": 10.0}]
+
+    ns["almacen"] = Almacen()
+    t = ns["LedgerFinanzas"]()
+    t.sincronizar(forzar=True)
+    assert list(t.df["id"]) == [1]
+
+
+# ---------------------------------------------------------
+# formato de montos: la versión por columna = la escalar
+# ---------------------------------------------------------
+MONTOS = cargar("formatear_monto_ars", "formatear_montos_ars", "_MILES", "_GRUPO_ALTO", "_CENTAVOS")
+
+
+def test_montos_vectorizado_igual_a_escalar():
+    valores = [
+        1.115, 2.675, 0.125, 1.005, 0.285, 1234567.895, -1234.565, 10.0, -200, 0, -0.0, -0.001,
+        999.995, 1e12 + 0.005, float("nan"), None, float("inf"), "abc", "1500",
+    ]
+    serie = MONTOS["pd"].Series(valores, dtype=object)
+    esperado = [MONTOS["formatear_monto_ars"](v) for v in valores]
+    assert MONTOS["formatear_montos_ars"](serie).tolist() == esperado
+    flotantes = MONTOS["pd"].Series([1.115, float("nan"), 2.675, -3.5])
+    assert MONTOS["formatear_montos_ars"](flotantes).tolist() == [MONTOS["formatear_monto_ars"](v) for v in flotantes]
+
+
+def test_backend_incompleto_falla_al_crearse():
+    ns = cargar("Repositorio")
+
+    class SinRpc(ns["Repositorio"]):
+        def bajar(self, tabla, columnas="*", desde_id=0): return []
+        def buscar_finanzas(self, busq, columnas, limite): return []
+        def contar(self, tabla, **filtros): return 0
+        def insertar(self, tabla, fila): return []
+        def actualizar(self, tabla, cambios, **filtros): return []
+        def borrar(self, tabla, **filtros): pass
+
+    import pytest
+    with pytest.raises(TypeError, match="rpc"):
+        SinRpc()
+
+
+# ---------------------------------------------------------
+# CacheFechas: se poda y no re-parsea las fechas nulas
+# ---------------------------------------------------------
+FECHAS = cargar("CacheFechas", "parsear_fechas", "TZ_AR", "FORMATO_FECHA_AR", "RX_FECHA_AR")
+
+
+def test_cache_fechas_poda_y_nulas():
+    pd = FECHAS["pd"]
+    llamadas = []
+    parsear = FECHAS["parsear_fechas"]
+    FECHAS["parsear_fechas"] = lambda f: llamadas.append(len(f)) or parsear(f)
+    try:
+        cache = FECHAS["CacheFechas"]()
+        ids = pd.Series([1, 2, 3])
+        fechas = pd.Series(["01/03/2025 10:00", None, "2025-03-02T13:00:00+00:00"], dtype=object)
+        out = cache.resolver(ids, fechas, completo=True)
+        assert out.isna().tolist() == [False, True, False]
+        cache.resolver(ids, fechas, completo=True)
+        assert llamadas == [3]  # la nula no se vuelve a parsear
+
+        cache.resolver(pd.Series([1, 3]), fechas.iloc[[0, 2]].reset_index(drop=True), completo=True)
+        assert sorted(cache.dt.index) == [1, 3] and sorted(cache.texto.index) == [1, 3]
+        cache.resolver(pd.Series([1]), fechas.iloc[[0]])  # una búsqueda no poda
+        assert sorted(cache.dt.index) == [1, 3]
+    finally:
+        FECHAS["parsear_fechas"] = parsear
+
+
+def test_ledger_trae_filas_rezagadas_por_debajo_de_max_id(tmp_path):
+    ns = cargar(
+        "TablaCache", "LedgerFinanzas", "upsert_por_id", "columnas", "COLUMNAS", "CACHE_TTL",
+        "FIN_RECONCILIAR_SEG", "LOTE_IDS", "Repositorio", "RepoSQLite", "DEFAULT_CATEGORIAS",
+    )
+    ns["almacen"] = repo = ns["RepoSQLite"](str(tmp_path / "ilara.sqlite3"))
+
+    def mov(i):
+        return {"id": i, "fecha": "01/03/2025 10:00", "tipo": "Gasto", "descripcion": f"mov {i}", "monto": -1.0}
+
+    repo.insertar("finanzas", mov(1))
+    repo.insertar("finanzas", mov(3))
+    t = ns["LedgerFinanzas"]()
+    t.sincronizar(forzar=True)
+    assert t.max_id == 3
+    # el 2 hace commit después de que el delta ya pasó por el 3
+    repo.insertar("finanzas", mov(2))
+    t.sincronizar(forzar=True)
+    assert sorted(t.df["id"]) == [1, 3]
+    t.reconciliado_en = 0.0
+    t.sincronizar(forzar=True)
+    assert sorted(t.df["id"]) == [1, 2, 3]
+
+
+# ---------------------------------------------------------
+# diario de escrituras
+# ---------------------------------------------------------
+def test_diario_envia_pendientes_de_antes_de_reiniciar(tmp_path):
+    ns = cargar("DiarioEscrituras", "Repositorio", "es_transitorio", "falta_funcion", "DIARIO_ESPERA_MAX_SEG")
+    ruta = str(tmp_path / "diario.sqlite3")
+    enviadas = []
+
+    class Almacen:
+        def rpc(self, nombre, args=None):
+            enviadas.append(args["p_clave"])
+            return {"id": 1}
+
+    class SinCargar:
+        sincronizado_en = 0.0
+
+    tablas = {"inventario": SinCargar(), "finanzas": SinCargar()}
+    class SesionAnterior(ns["DiarioEscrituras"]):
+        def _bucle(self):
+            pass  # se cortó antes de enviar
+
+    clave = SesionAnterior(ruta, Almacen(), tablas).agregar("finanzas", {"tipo": "Gasto"}, "gasto")
+
+    d = ns["DiarioEscrituras"](ruta, Almacen(), tablas)
+    for _ in range(100):
+        if not d.pendientes():
+            break
+        ns["time"].sleep(0.05)
+    assert d.pendientes() == 0
+    assert clave in enviadas
+
+
+def test_venta_y_ajuste_llevan_la_fecha_en_que_se_anotaron(tmp_path):
+    ns = cargar(
+        "DiarioEscrituras", "Repositorio", "RepoSQLite", "es_transitorio", "falta_funcion",
+        "DIARIO_ESPERA_MAX_SEG", "DEFAULT_CATEGORIAS",
+    )
+    repo = ns["RepoSQLite"](str(tmp_path / "ilara.sqlite3"))
+    prod = repo.insertar("inventario", {"producto": "Labial", "marca": "X", "stock": 5})[0]
+
+    class SinCargar:
+        sincronizado_en = 0.0
+
+    class SesionAnterior(ns["DiarioEscrituras"]):
+        def _bucle(self):
+            pass
+
+    ruta = str(tmp_path / "diario.sqlite3")
+    tablas = {"inventario": SinCargar(), "finanzas": SinCargar()}
+    ns["now_ar_str"] = lambda: "01/03/2025 10:00"
+    previo = SesionAnterior(ruta, repo, tablas)
+    previo.agregar("venta", {
+        "p_items": [{"producto_id": prod["id"], "cantidad": 1}],
+        "p_monto_total": 100.0, "p_descripcion": "venta", "p_metodo_pago": "Efectivo",
+    }, "venta")
+    previo.agregar("ajuste", {"p_producto_id": prod["id"], "p_delta": -1, "p_motivo": "rotura"}, "ajuste")
+
+    ns["now_ar_str"] = lambda: "02/03/2025 09:00"  # se envían al día siguiente
+    previo.despachar()
+    assert [r["fecha"] for r in repo.bajar("finanzas", "fecha")] == ["01/03/2025 10:00"] * 2
+
+
+# ---------------------------------------------------------
+# pie: antigüedad de los datos mostrados
+# ---------------------------------------------------------
+def test_edad_solo_de_las_tablas_cargadas_en_esta_corrida():
+    ns = cargar("edad_datos_txt")
+
+    class Tabla:
+        def __init__(self, edad):
+            self.edad = lambda: edad
+
+    ns["tablas"] = lambda: {"inventario": Tabla(5.0), "finanzas": Tabla(3600.0), "categorias": Tabla(2.0)}
+    ns["st"].session_state["_tablas_carga"] = ["inventario", "categorias"]
+    assert ns["edad_datos_txt"]() == "datos de hace 5 s"